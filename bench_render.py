@@ -0,0 +1,64 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import telegram_reminder_bot as reminder_bot
+
+REMINDERS = int(os.getenv('RENDER_REMINDERS', '50'))
+RUNS = int(os.getenv('RENDER_RUNS', '2000'))
+
+FREQUENCIES = ['daily', 'weekdays', '3_times_daily', 'friday', 'RRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR;BYTIME=08:00']
+
+def make_rows():
+    rows = []
+    for i in range(REMINDERS):
+        rows.append((
+            i, 100000 + i, f"Напоминание номер {i} с текстом средней длины",
+            '09:00', FREQUENCIES[i % len(FREQUENCIES)], 1,
+            '2026-10-19 09:00:00', '2026-10-19 09:00:05' if i % 2 else None
+        ))
+    return rows
+
+def render_admin_concat(rows):
+    # Прежняя реализация admin_command: конкатенация f-строк и обрезка по 3500 символов
+    text = "🔐 **Админская панель - Все напоминания:**\n\n"
+    for reminder in rows:
+        reminder_id, user_id, message, reminder_time, frequency, is_active, created_at, last_sent = reminder
+        text += f"🆔 ID: {reminder_id}\n"
+        text += f"👤 Пользователь: {user_id}\n"
+        text += f"📝 Сообщение: {message}\n"
+        text += f"⏰ Время: {reminder_time}\n"
+        text += f"🔄 Частота: {frequency}\n"
+        text += f"✅ Активно: {bool(is_active)}\n"
+        text += f"📅 Создано: {created_at}\n"
+        text += f"📤 Последняя отправка: {last_sent or 'Никогда'}\n\n"
+
+        if len(text) > 3500:
+            text += "... (показаны первые 50 напоминаний)"
+            break
+    return [text]
+
+def main():
+    rows = make_rows()
+
+    concat_s = min(timeit.repeat(lambda: render_admin_concat(rows), number=RUNS, repeat=3))
+    template_s = min(timeit.repeat(lambda: reminder_bot.render_admin(rows), number=RUNS, repeat=3))
+
+    chunks = reminder_bot.render_admin(rows)
+    shown_before = render_admin_concat(rows)[0].count("🆔")
+    shown_after = sum(chunk.count("🆔") for chunk in chunks)
+
+    print(f"Рендер {REMINDERS} напоминаний, {RUNS} повторов")
+    print(f"  конкатенация: {concat_s / RUNS * 1e6:.1f} мкс (показано {shown_before} напоминаний)")
+    print(f"  шаблоны:      {template_s / RUNS * 1e6:.1f} мкс (показано {shown_after} напоминаний в {len(chunks)} сообщениях)")
+    print(f"  на одно напоминание: {concat_s / RUNS / shown_before * 1e6:.2f} -> {template_s / RUNS / shown_after * 1e6:.2f} мкс")
+
+    if any(reminder_bot.utf16_len(chunk) > reminder_bot.TELEGRAM_MESSAGE_LIMIT for chunk in chunks):
+        print("❌ сообщение превышает лимит Telegram")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
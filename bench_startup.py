@@ -0,0 +1,102 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+# Два замера: импорт модуля (его платят скрипты и бенчмарки) и время до готовности
+# процесса worker из Procfile - main() вплоть до run_polling, где уже нужен telegram.ext.
+# Бюджеты в мс переопределяются через IMPORT_BUDGET_MS и READY_BUDGET_MS
+IMPORT_BUDGET_MS = float(os.getenv('IMPORT_BUDGET_MS', '150'))
+READY_BUDGET_MS = float(os.getenv('READY_BUDGET_MS', '1000'))
+RUNS = int(os.getenv('IMPORT_RUNS', '5'))
+MODULE = 'telegram_reminder_bot'
+
+# Эти модули не должны загружаться при простом импорте бота
+FORBIDDEN_MODULES = ['telegram', 'httpx', 'schedule', 'cProfile', 'pstats']
+
+def measure_import(workdir: str) -> tuple:
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    code = f"import sys; sys.path.insert(0, {repo_dir!r}); import {MODULE}"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=workdir, capture_output=True, text=True, check=True
+    )
+
+    imported = set()
+    module_us = None
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if not match:
+            continue
+        name = match.group(4)
+        imported.add(name.split('.')[0])
+        if name == MODULE:
+            module_us = int(match.group(2))
+
+    return module_us / 1000, imported
+
+# run_polling подменяется: сеть не нужна, замер останавливается там, где бот начал бы опрос
+READY_CODE = '''
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo_dir!r})
+import telegram.ext
+def run_polling(self, *args, **kwargs):
+    print("READY_MS", (time.perf_counter() - started) * 1000)
+telegram.ext.Application.run_polling = run_polling
+import {module}
+{module}.main()
+'''
+
+def measure_ready() -> float:
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    code = READY_CODE.format(repo_dir=repo_dir, module=MODULE)
+    # Каждый запуск в чистом каталоге: main() создаёт reminders.db с нуля
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=workdir, capture_output=True, text=True, check=True,
+            env={**os.environ, 'BOT_TOKEN': '123456:bench'}
+        )
+    match = re.search(r'READY_MS ([\d.]+)', result.stdout)
+    return float(match.group(1))
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        timings = []
+        imported = set()
+        for _ in range(RUNS):
+            duration_ms, imported = measure_import(workdir)
+            timings.append(duration_ms)
+
+        created_files = os.listdir(workdir)
+
+    best = min(timings)
+    print(f"Импорт {MODULE}: лучший {best:.1f} мс, медиана {sorted(timings)[len(timings) // 2]:.1f} мс ({RUNS} запусков)")
+
+    ready_timings = sorted(measure_ready() for _ in range(RUNS))
+    best_ready = ready_timings[0]
+    print(f"До готовности main() (run_polling): лучший {best_ready:.1f} мс, медиана {ready_timings[len(ready_timings) // 2]:.1f} мс ({RUNS} запусков)")
+    
+    errors = []
+    if best > IMPORT_BUDGET_MS:
+        errors.append(f"импорт занимает {best:.1f} мс при бюджете {IMPORT_BUDGET_MS:.0f} мс")
+    
+    if best_ready > READY_BUDGET_MS:
+        errors.append(f"запуск до run_polling занимает {best_ready:.1f} мс при бюджете {READY_BUDGET_MS:.0f} мс")
+
+    leaked = sorted(name for name in FORBIDDEN_MODULES if name in imported)
+    if leaked:
+        errors.append(f"при импорте загружаются тяжёлые модули: {', '.join(leaked)}")
+
+    if created_files:
+        errors.append(f"импорт создаёт файлы: {', '.join(created_files)}")
+
+    for error in errors:
+        print(f"❌ {error}")
+
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import telegram_reminder_bot as reminder_bot
+
+REMINDERS = int(os.getenv('SIM_REMINDERS', '200'))
+DAYS = float(os.getenv('SIM_DAYS', '2'))
+TICK_INTERVAL = float(os.getenv('SIM_TICK', '30'))
+SEED = int(os.getenv('SIM_SEED', '42'))
+START = os.getenv('SIM_START', '2026-01-05 00:00')
+# 0 - только такты сетки, без пробуждения к дедлайнам напоминаний
+DEADLINES = os.getenv('SIM_DEADLINES', '1') == '1'
+
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+def seed_reminders(rng: random.Random, start: datetime, end: datetime) -> list:
+    def at():
+        return f"{rng.randrange(7, 23):02d}:{rng.choice([0, 15, 30, 45]):02d}"
+
+    def clock_time(value):
+        return datetime.strptime(value, '%H:%M').time()
+
+    makers = [
+        lambda: (at(), 'daily'),
+        lambda: (at(), 'weekdays'),
+        lambda: (at(), 'weekends'),
+        lambda: (at(), rng.choice(reminder_bot.WEEKDAY_NAMES)),
+        lambda: ('09:00', f"{rng.randrange(2, 5)}_times_daily"),
+        # Больше 8 срабатываний в день - шире стандартного окна кэша правил
+        lambda: ('09:00', f"{rng.randrange(10, 25)}_times_daily"),
+        lambda: (at(), f"{rng.randrange(2, 4)}_times_weekly"),
+        lambda: (lambda t: (t, reminder_bot.RecurrenceRule(
+            'DAILY', [clock_time(t)], rng.randrange(2, 4), start=start.date()).to_rrule()))(at()),
+        lambda: (lambda t: (t, reminder_bot.RecurrenceRule(
+            'MONTHLY', [clock_time(t)], month_days=[rng.randrange(1, 29)]).to_rrule()))(at()),
+        lambda: ((start + timedelta(minutes=rng.randrange(int((end - start).total_seconds() // 60)))).strftime('%Y-%m-%d %H:%M'), 'once'),
+    ]
+
+    rows = []
+    for i in range(REMINDERS):
+        reminder_time, frequency = rng.choice(makers)()
+        rows.append((rng.randrange(1, 200), f"Напоминание {i}", reminder_time, frequency))
+    return rows
+
+WEEKLY_DAYS = {1: {0}, 2: {0, 4}, 3: {0, 2, 5}}
+
+# Ожидаемые срабатывания считаются перебором по минутам прямо по определению частоты,
+# без RecurrenceRule - иначе симуляция проверяла бы движок правил им же самим
+def fire_matcher(reminder_time: str, frequency: str):
+    def minutes(value):
+        hour, minute = value.split(':')
+        return int(hour) * 60 + int(minute)
+
+    if frequency == 'once':
+        at = datetime.strptime(reminder_time[:16], '%Y-%m-%d %H:%M')
+        return lambda moment: moment == at
+
+    days = {'daily': range(7), 'weekdays': range(5), 'weekends': (5, 6)}
+    if frequency in days or frequency in reminder_bot.WEEKDAY_NAMES:
+        weekdays = set(days[frequency]) if frequency in days else {reminder_bot.WEEKDAY_NAMES.index(frequency)}
+        at = minutes(reminder_time)
+        return lambda moment: moment.weekday() in weekdays and moment.hour * 60 + moment.minute == at
+
+    if frequency.endswith('_times_daily'):
+        # N раз в день равномерно от указанного времени до 21:00, с округлением вниз до минуты
+        count = int(frequency.split('_')[0])
+        first, last = minutes(reminder_time), 21 * 60
+        slots = {first + (last - first) * i // (count - 1) for i in range(count)}
+        return lambda moment: moment.hour * 60 + moment.minute in slots
+
+    if frequency.endswith('_times_weekly'):
+        # N раз в неделю: дни равномерно по неделе, начиная с понедельника (выписаны вручную)
+        weekdays = WEEKLY_DAYS[int(frequency.split('_')[0])]
+        at = minutes(reminder_time)
+        return lambda moment: moment.weekday() in weekdays and moment.hour * 60 + moment.minute == at
+
+    parts = dict(part.split('=', 1) for part in frequency[len('RRULE:'):].split(';'))
+    at = minutes(parts['BYTIME'])
+    interval = int(parts.get('INTERVAL', 1))
+    dtstart = datetime.strptime(parts['DTSTART'], '%Y-%m-%d').date() if 'DTSTART' in parts else None
+    weekdays = {['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'].index(code) for code in parts['BYDAY'].split(',')} if 'BYDAY' in parts else None
+
+    def matches(moment):
+        day = moment.date()
+        if moment.hour * 60 + moment.minute != at or (dtstart and day < dtstart):
+            return False
+        if parts['FREQ'] == 'MONTHLY':
+            return day.day == int(parts['BYMONTHDAY'])
+        if parts['FREQ'] == 'WEEKLY':
+            # Интервал в неделях считается от понедельника недели DTSTART
+            weeks = (day - dtstart).days // 7 + (dtstart.weekday() > day.weekday()) if dtstart else 0
+            return day.weekday() in weekdays and weeks % interval == 0
+        return dtstart is None or (day - dtstart).days % interval == 0
+    return matches
+
+def expected_fires(reminder_time: str, frequency: str, start: datetime, end: datetime) -> int:
+    matches = fire_matcher(reminder_time, frequency)
+    moment = start
+    fires = 0
+    while moment <= end:
+        fires += matches(moment)
+        moment += timedelta(minutes=1)
+    return fires
+
+def percentile(samples: list, p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+def main():
+    rng = random.Random(SEED)
+    start = datetime.strptime(START, '%Y-%m-%d %H:%M')
+    end = start + timedelta(days=DAYS)
+    clock = reminder_bot.SimulatedClock(MOSCOW_TZ.localize(start))
+
+    # Стоимость запросов берётся из спанов профайлера, медленные операции не логируются
+    reminder_bot.profiler.enabled = True
+    reminder_bot.profiler.slow_threshold_ms = float('inf')
+    reminder_bot.fire_lateness = reminder_bot.LatenessStats(max_samples=10 ** 7)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = reminder_bot.ReminderBot('simulation', clock=clock)
+        bot.db_path = os.path.join(workdir, 'reminders.db')
+        bot.init_database()
+
+        rows = seed_reminders(rng, start, end)
+        conn = bot.connect()
+        conn.executemany('''
+            INSERT INTO reminders (user_id, message, reminder_time, frequency)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        conn.close()
+
+        scheduler = reminder_bot.SchedulerManager(bot, None, tick_interval=TICK_INTERVAL)
+        ticks = []
+
+        def on_tick(scheduler, tick_seconds):
+            with reminder_bot.profiler.lock:
+                db_stats = [entry for name, entry in reminder_bot.profiler.stats.items() if name.startswith('db.')]
+                reminder_bot.profiler.stats.clear()
+            ticks.append((
+                scheduler.last_enqueued,
+                sum(entry[0] for entry in db_stats),
+                sum(entry[1] for entry in db_stats),
+                tick_seconds * 1000
+            ))
+            if not DEADLINES:
+                scheduler.next_deadline = None
+
+        started = time.perf_counter()
+        scheduler.run_simulated(MOSCOW_TZ.localize(end).timestamp(), on_tick)
+        wall_seconds = time.perf_counter() - started
+
+        conn = bot.connect()
+        fired = dict(conn.execute('SELECT reminder_id, COUNT(*) FROM outbox GROUP BY reminder_id').fetchall())
+        reminders = conn.execute('SELECT id, reminder_time, frequency FROM reminders').fetchall()
+        conn.close()
+
+    missed = 0
+    extra = 0
+    expected_total = 0
+    for reminder_id, reminder_time, frequency in reminders:
+        expected = expected_fires(reminder_time, frequency, start, end)
+        actual = fired.get(reminder_id, 0)
+        expected_total += expected
+        missed += max(0, expected - actual)
+        extra += max(0, actual - expected)
+
+    lateness = sorted(reminder_bot.fire_lateness.samples)
+    queries = sorted(tick[1] for tick in ticks)
+    db_ms = sorted(tick[2] for tick in ticks)
+    tick_ms = sorted(tick[3] for tick in ticks)
+    busy_ticks = sum(1 for tick in ticks if tick[0])
+
+    print(f"Симуляция {DAYS:g} дн. с {START}: {REMINDERS} напоминаний, такт {TICK_INTERVAL:g} с, "
+          f"дедлайны {'вкл' if DEADLINES else 'выкл'}, seed {SEED}")
+    print(f"  тактов: {len(ticks) + scheduler.skipped_ticks} (полных проходов {len(ticks)}, с отправками {busy_ticks}), "
+          f"{wall_seconds:.1f} с реального времени, "
+          f"ускорение x{DAYS * 86400 / max(wall_seconds, 1e-9):.0f}")
+    print(f"  срабатываний: {sum(fired.values())} из ожидаемых {expected_total}, пропущено {missed}, лишних {extra}")
+    # Часы симуляции не идут во время такта, поэтому это только опоздание постановки в outbox
+    # относительно дедлайна, без времени обработки такта и доставки
+    print(f"  опоздание постановки в очередь (без обработки и доставки): p50={percentile(lateness, 0.5):.2f} с, p99={percentile(lateness, 0.99):.2f} с, "
+          f"макс={lateness[-1] if lateness else 0:.2f} с")
+    print(f"  запросов к БД за такт: среднее {sum(queries) / max(len(queries), 1):.1f}, макс {queries[-1] if queries else 0}")
+    print(f"  время БД за такт: среднее {sum(db_ms) / max(len(db_ms), 1):.2f} мс, "
+          f"p99 {percentile(db_ms, 0.99):.2f} мс, макс {db_ms[-1] if db_ms else 0:.2f} мс")
+    print(f"  время такта: среднее {sum(tick_ms) / max(len(tick_ms), 1):.2f} мс, "
+          f"p99 {percentile(tick_ms, 0.99):.2f} мс, макс {tick_ms[-1] if tick_ms else 0:.2f} мс")
+
+    if missed or extra:
+        print("❌ число срабатываний расходится с расписанием")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,27 @@
+from __future__ import annotations
+
 import asyncio
 import sqlite3
 import logging
 import os
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, TYPE_CHECKING
 import re
-import schedule
+import random
+import sys
+import functools
+import bisect
+from contextlib import nullcontext
 import time
-from threading import Thread
-import json
+from collections import deque
+from threading import Thread, Lock, Event
 import pytz
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+# python-telegram-bot тянет httpx и импортируется дольше всего остального вместе,
+# поэтому он загружается только там, где действительно нужен
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -20,11 +29,405 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class _Span:
+    __slots__ = ('profiler', 'name', 'fields', 'started')
+    
+    def __init__(self, profiler, name: str, fields: Dict):
+        self.profiler = profiler
+        self.name = name
+        self.fields = fields
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.name, (time.perf_counter() - self.started) * 1000, self.fields)
+        return False
+
+class Profiler:
+    def __init__(self, enabled: bool, slow_threshold_ms: float):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        # name -> [количество, суммарное время мс, максимум мс]
+        self.stats = {}
+        self.lock = Lock()
+        self.cprofile_requested = False
+        self.last_cprofile_report = None
+        self._null_span = nullcontext()
+    
+    def span(self, name: str, **fields):
+        if not self.enabled:
+            return self._null_span
+        return _Span(self, name, fields)
+    
+    def record(self, name: str, duration_ms: float, fields: Dict):
+        with self.lock:
+            entry = self.stats.get(name)
+            if entry is None:
+                self.stats[name] = [1, duration_ms, duration_ms]
+            else:
+                entry[0] += 1
+                entry[1] += duration_ms
+                if duration_ms > entry[2]:
+                    entry[2] = duration_ms
+        
+        if duration_ms >= self.slow_threshold_ms:
+            import json
+            logger.warning(json.dumps({
+                'event': 'slow_operation',
+                'name': name,
+                'duration_ms': round(duration_ms, 2),
+                **fields
+            }, ensure_ascii=False, default=str))
+    
+    def report(self) -> str:
+        with self.lock:
+            rows = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)
+        
+        if not rows:
+            return "Нет данных профилирования."
+        
+        lines = ["операция: вызовов / всего мс / среднее мс / макс мс"]
+        for name, (count, total, maximum) in rows:
+            lines.append(f"{name}: {count} / {total:.1f} / {total / count:.2f} / {maximum:.1f}")
+        return "\n".join(lines)
+    
+    def run_with_cprofile(self, func):
+        # Профилирует один вызов, если снимок был запрошен через /admin
+        if not self.cprofile_requested:
+            return func()
+        
+        import cProfile
+        import io
+        import pstats
+        
+        self.cprofile_requested = False
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func)
+        finally:
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(25)
+            self.last_cprofile_report = output.getvalue()
+            logger.info("Снимок cProfile сохранён")
+    
+    def sample_threads(self) -> str:
+        # Мгновенный снимок стеков всех потоков - дешёвая замена семплирующему профайлеру
+        import traceback
+        
+        chunks = []
+        for thread_id, frame in sys._current_frames().items():
+            stack = ''.join(traceback.format_stack(frame, limit=8))
+            chunks.append(f"Поток {thread_id}:\n{stack}")
+        return "\n".join(chunks)
+
+profiler = Profiler(
+    enabled=os.getenv('PROFILING', '0') == '1',
+    slow_threshold_ms=float(os.getenv('SLOW_OPERATION_MS', '200'))
+)
+
+class SystemClock:
+    # Источник текущего времени; в симуляции подменяется на SimulatedClock
+    def time(self) -> float:
+        return time.time()
+    
+    def now(self, tz) -> datetime:
+        return datetime.now(tz)
+
+class SimulatedClock(SystemClock):
+    # Детерминированное время: стоит на месте, пока его явно не сдвинут
+    def __init__(self, start: datetime):
+        self.current = start.timestamp()
+    
+    def time(self) -> float:
+        return self.current
+    
+    def now(self, tz) -> datetime:
+        return datetime.fromtimestamp(self.current, tz)
+    
+    def advance(self, seconds: float):
+        self.current += seconds
+    
+    def advance_to(self, timestamp: float):
+        self.current = max(self.current, timestamp)
+
+class LatenessStats:
+    def __init__(self, max_samples: int = 1000):
+        self.samples = deque(maxlen=max_samples)
+        self.lock = Lock()
+    
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+    
+    def report(self) -> str:
+        with self.lock:
+            samples = sorted(self.samples)
+        
+        if not samples:
+            return "нет данных"
+        
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+        
+        return (
+            f"n={len(samples)}, p50={percentile(0.5):.2f} с, p90={percentile(0.9):.2f} с, "
+            f"p99={percentile(0.99):.2f} с, макс={samples[-1]:.2f} с"
+        )
+
+# Опоздание относительно запланированного времени: постановки в outbox и фактической отправки
+fire_lateness = LatenessStats()
+delivery_lateness = LatenessStats()
+
+def parse_once_time(reminder_time: str) -> datetime:
+    # Относительные напоминания хранятся с секундами, остальные - с точностью до минуты
+    if len(reminder_time) > 16:
+        return datetime.strptime(reminder_time, '%Y-%m-%d %H:%M:%S')
+    return datetime.strptime(reminder_time, '%Y-%m-%d %H:%M')
+
+WEEKDAY_CODES = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Окно периодических "N раз в день": от указанного времени до 21:00
+TIMES_DAILY_END = 21 * 60
+
+# Сколько ближайших срабатываний правила держится в кэше и как далеко их искать
+OCCURRENCE_WINDOW_SIZE = 16
+OCCURRENCE_SEARCH_DAYS = 400
+
+# "по пн, ср, пт в 08:00" - несколько дней недели через запятую
+WEEKDAY_LIST_PATTERN = r'по ((?:пн|вт|ср|чт|пт|сб|вс)(?:\s*,\s*(?:пн|вт|ср|чт|пт|сб|вс))+) в (\d{1,2}):(\d{2})'
+
+class RecurrenceRule:
+    def __init__(self, freq: str, times: List, interval: int = 1, weekdays=None,
+                 month_days=None, start=None, until=None):
+        self.freq = freq
+        self.times = sorted(times)
+        self.interval = max(1, interval)
+        self.weekdays = frozenset(weekdays) if weekdays else None
+        self.month_days = frozenset(month_days) if month_days else None
+        self.start = start
+        self.until = until
+        # Кэш окна: (начало окна, конец окна, отсортированный список срабатываний)
+        self._window = None
+    
+    @classmethod
+    def parse(cls, frequency: str, reminder_time: str) -> Optional[RecurrenceRule]:
+        try:
+            if frequency.startswith('RRULE:'):
+                return cls._parse_rrule(frequency[6:], reminder_time)
+            return cls._parse_legacy(frequency, reminder_time)
+        except (ValueError, KeyError):
+            return None
+    
+    @classmethod
+    def _parse_legacy(cls, frequency: str, reminder_time: str) -> Optional[RecurrenceRule]:
+        at = datetime.strptime(reminder_time, '%H:%M').time()
+        
+        if frequency == 'daily':
+            return cls('DAILY', [at])
+        if frequency == 'weekdays':
+            return cls('WEEKLY', [at], weekdays=range(5))
+        if frequency == 'weekends':
+            return cls('WEEKLY', [at], weekdays=(5, 6))
+        if frequency in WEEKDAY_NAMES:
+            return cls('WEEKLY', [at], weekdays=[WEEKDAY_NAMES.index(frequency)])
+        
+        if frequency.endswith('_times_daily'):
+            count = max(1, int(frequency.split('_')[0]))
+            first = at.hour * 60 + at.minute
+            last = TIMES_DAILY_END if first < TIMES_DAILY_END else 23 * 60 + 59
+            step = (last - first) / (count - 1) if count > 1 else 0
+            minutes = sorted({int(first + step * i) for i in range(count)})
+            return cls('DAILY', [datetime.min.replace(hour=m // 60, minute=m % 60).time() for m in minutes])
+        
+        if frequency.endswith('_times_weekly'):
+            count = min(7, max(1, int(frequency.split('_')[0])))
+            # Дни распределяются по неделе равномерно, начиная с понедельника
+            return cls('WEEKLY', [at], weekdays={round(i * 7 / count) % 7 for i in range(count)})
+        
+        return None
+    
+    @classmethod
+    def _parse_rrule(cls, body: str, reminder_time: str) -> Optional[RecurrenceRule]:
+        parts = dict(part.split('=', 1) for part in body.split(';') if part)
+        
+        freq = parts['FREQ']
+        if freq not in ('DAILY', 'WEEKLY', 'MONTHLY'):
+            return None
+        
+        times_value = parts.get('BYTIME', reminder_time)
+        times = [datetime.strptime(value, '%H:%M').time() for value in times_value.split(',')]
+        
+        weekdays = None
+        if 'BYDAY' in parts:
+            weekdays = [WEEKDAY_CODES.index(code) for code in parts['BYDAY'].split(',')]
+        
+        month_days = None
+        if 'BYMONTHDAY' in parts:
+            month_days = [int(day) for day in parts['BYMONTHDAY'].split(',')]
+        
+        start = datetime.strptime(parts['DTSTART'], '%Y-%m-%d').date() if 'DTSTART' in parts else None
+        until = datetime.strptime(parts['UNTIL'], '%Y-%m-%d').date() if 'UNTIL' in parts else None
+        
+        return cls(freq, times, int(parts.get('INTERVAL', 1)), weekdays, month_days, start, until)
+    
+    def to_rrule(self) -> str:
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.weekdays is not None:
+            parts.append("BYDAY=" + ','.join(WEEKDAY_CODES[day] for day in sorted(self.weekdays)))
+        if self.month_days is not None:
+            parts.append("BYMONTHDAY=" + ','.join(str(day) for day in sorted(self.month_days)))
+        parts.append("BYTIME=" + ','.join(t.strftime('%H:%M') for t in self.times))
+        if self.start:
+            parts.append(f"DTSTART={self.start.isoformat()}")
+        if self.until:
+            parts.append(f"UNTIL={self.until.isoformat()}")
+        return "RRULE:" + ';'.join(parts)
+    
+    def _matches_day(self, day) -> bool:
+        if self.weekdays is not None and day.weekday() not in self.weekdays:
+            return False
+        
+        if self.month_days is not None:
+            next_day = day + timedelta(days=1)
+            # -1 в BYMONTHDAY означает последний день месяца
+            if day.day not in self.month_days and not (-1 in self.month_days and next_day.month != day.month):
+                return False
+        
+        if self.interval == 1 or self.start is None:
+            return True
+        
+        if self.freq == 'DAILY':
+            return (day - self.start).days % self.interval == 0
+        if self.freq == 'WEEKLY':
+            start_week = self.start - timedelta(days=self.start.weekday())
+            return ((day - start_week).days // 7) % self.interval == 0
+        months = (day.year - self.start.year) * 12 + day.month - self.start.month
+        return months % self.interval == 0
+    
+    def next_occurrences(self, after: datetime, count: int) -> List[datetime]:
+        # Все срабатывания >= after (наивное локальное время), не больше count штук
+        occurrences = []
+        day = after.date()
+        if self.start and day < self.start:
+            day = self.start
+        
+        for _ in range(OCCURRENCE_SEARCH_DAYS):
+            if self.until and day > self.until:
+                break
+            if self._matches_day(day):
+                for at in self.times:
+                    occurrence = datetime.combine(day, at)
+                    if occurrence >= after:
+                        occurrences.append(occurrence)
+                        if len(occurrences) >= count:
+                            return occurrences
+            day += timedelta(days=1)
+        
+        return occurrences
+    
+    def _occurrence_window(self, now: datetime) -> List[datetime]:
+        window = self._window
+        if window is not None and window[0] <= now < window[1]:
+            return window[2]
+        
+        # Окно начинается с начала сегодняшнего дня и вмещает все сегодняшние срабатывания
+        # плюс не меньше стольких же будущих, иначе частые правила теряют вечерние слоты
+        window_start = datetime.combine(now.date(), datetime.min.time())
+        window_size = max(OCCURRENCE_WINDOW_SIZE, 2 * len(self.times))
+        occurrences = self.next_occurrences(window_start, window_size)
+        
+        if len(occurrences) == window_size and occurrences[-1] > now:
+            window_end = occurrences[-1]
+        else:
+            window_end = now + timedelta(days=1)
+        
+        self._window = (window_start, window_end, occurrences)
+        return occurrences
+    
+    def latest_today(self, now: datetime) -> Optional[datetime]:
+        # Последнее срабатывание сегодня, которое уже наступило
+        occurrences = self._occurrence_window(now)
+        index = bisect.bisect_right(occurrences, now)
+        if index and occurrences[index - 1].date() == now.date():
+            return occurrences[index - 1]
+        return None
+    
+    def next_after(self, now: datetime) -> Optional[datetime]:
+        occurrences = self._occurrence_window(now)
+        index = bisect.bisect_right(occurrences, now)
+        if index < len(occurrences):
+            return occurrences[index]
+        return None
+
+@functools.lru_cache(maxsize=4096)
+def get_recurrence(frequency: str, reminder_time: str) -> Optional[RecurrenceRule]:
+    # Одинаковые правила (например, все "каждый день в 09:00") разделяют объект и его окно срабатываний
+    return RecurrenceRule.parse(frequency, reminder_time)
+
+def profiled(handler):
+    # Без PROFILING обработчик регистрируется как есть, без обёртки
+    if not profiler.enabled:
+        return handler
+    
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        with profiler.span(f"handler.{handler.__name__}"):
+            return await handler(update, context)
+    
+    return wrapper
+
+class ProfiledCursor(sqlite3.Cursor):
+    # SQLite выполняет SELECT по шагам во время выборки строк, поэтому
+    # выборка замеряется отдельным спаном db.<оператор>.fetch
+    span_name = 'db'
+    
+    def execute(self, sql, parameters=()):
+        statement = ' '.join(sql.split())
+        self.span_name = f"db.{statement.split(' ', 1)[0].lower()}"
+        with profiler.span(self.span_name, sql=statement[:120]):
+            return super().execute(sql, parameters)
+    
+    def fetchone(self):
+        with profiler.span(f"{self.span_name}.fetch"):
+            return super().fetchone()
+    
+    def fetchmany(self, size=None):
+        with profiler.span(f"{self.span_name}.fetch"):
+            return super().fetchmany(self.arraysize if size is None else size)
+    
+    def fetchall(self):
+        with profiler.span(f"{self.span_name}.fetch"):
+            return super().fetchall()
+    
+    def executemany(self, sql, seq_of_parameters):
+        statement = ' '.join(sql.split())
+        with profiler.span(f"db.{statement.split(' ', 1)[0].lower()}", sql=statement[:120], batch=True):
+            return super().executemany(sql, seq_of_parameters)
+
+class ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
 class ReminderBot:
-    def __init__(self, token: str):
+    def __init__(self, token: str, clock: Optional[SystemClock] = None):
         self.token = token
         self.db_path = "reminders.db"
-        self.init_database()
+        self.clock = clock or SystemClock()
+        # Чаты, заблокировавшие бота: отправка в них пропускается без обращения к Telegram
+        self.blocked_chats = set()
+        # Будят планировщик при изменении напоминаний и обработчик отправки при новых записях в outbox
+        self.reminders_changed = Event()
+        self.outbox_ready = Event()
+    
+    def connect(self) -> sqlite3.Connection:
+        if profiler.enabled:
+            return sqlite3.connect(self.db_path, factory=ProfiledConnection)
+        return sqlite3.connect(self.db_path)
     
     def get_user_timezone(self, user_id: int) -> str:
         return 'Europe/Moscow'
@@ -34,10 +437,10 @@ class ReminderBot:
     
     def get_local_time(self, user_id: int) -> datetime:
         moscow_tz = pytz.timezone('Europe/Moscow')
-        return datetime.now(moscow_tz)
+        return self.clock.now(moscow_tz)
         
     def init_database(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -49,7 +452,85 @@ class ReminderBot:
                 frequency TEXT NOT NULL,
                 is_active BOOLEAN DEFAULT 1,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_sent TIMESTAMP
+                last_sent TIMESTAMP,
+                chat_id INTEGER
+            )
+        ''')
+        
+        # Дополнительные получатели напоминания: одна запись напоминания, рассылка в несколько чатов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_recipients (
+                reminder_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (reminder_id, chat_id)
+            )
+        ''')
+        
+        # Очередь исходящих уведомлений: планировщик пишет сюда, DeliveryWorker отправляет
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                reminder_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                due_at REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        ''')
+        
+        # Сюда фоновое обслуживание переносит выполненные и деактивированные напоминания
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminders_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                reminder_time TEXT NOT NULL,
+                frequency TEXT NOT NULL,
+                created_at TIMESTAMP,
+                last_sent TIMESTAMP,
+                chat_id INTEGER,
+                archive_reason TEXT NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('PRAGMA table_info(outbox)')
+        outbox_columns = {row[1] for row in cursor.fetchall()}
+        if 'due_at' not in outbox_columns:
+            cursor.execute('ALTER TABLE outbox ADD COLUMN due_at REAL')
+        if 'chat_id' not in outbox_columns:
+            cursor.execute('ALTER TABLE outbox ADD COLUMN chat_id INTEGER')
+        
+        # chat_id пуст у личных напоминаний - они уходят в чат с автором (user_id)
+        cursor.execute('PRAGMA table_info(reminders)')
+        reminder_columns = {row[1] for row in cursor.fetchall()}
+        if 'chat_id' not in reminder_columns:
+            cursor.execute('ALTER TABLE reminders ADD COLUMN chat_id INTEGER')
+        
+        cursor.execute('PRAGMA table_info(reminders_archive)')
+        archive_columns = {row[1] for row in cursor.fetchall()}
+        if 'chat_id' not in archive_columns:
+            cursor.execute('ALTER TABLE reminders_archive ADD COLUMN chat_id INTEGER')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_pending
+            ON outbox (status, next_attempt_at)
+        ''')
+        
+        # Контрольная точка планировщика для перезапуска без повторной работы
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
@@ -62,33 +543,178 @@ class ReminderBot:
         ''')
         
         conn.commit()
+        
+        # Переключение в INCREMENTAL применяется только после полного VACUUM. Он держит
+        # эксклюзивную блокировку, поэтому делается один раз здесь, до запуска потоков
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            logger.info("Переводим базу в режим incremental auto_vacuum")
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        
         conn.close()
     
-    def add_reminder(self, user_id: int, message: str, reminder_time: str, frequency: str) -> int:
-        conn = sqlite3.connect(self.db_path)
+    def add_reminder(self, user_id: int, message: str, reminder_time: str, frequency: str, chat_id: Optional[int] = None) -> int:
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO reminders (user_id, message, reminder_time, frequency)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, message, reminder_time, frequency))
+            INSERT INTO reminders (user_id, message, reminder_time, frequency, chat_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, message, reminder_time, frequency, chat_id))
         
         reminder_id = cursor.lastrowid
         conn.commit()
         conn.close()
         
+        # Пользователь снова пишет боту - значит, он его разблокировал
+        self.blocked_chats.discard(user_id if chat_id is None else chat_id)
+        self.reminders_changed.set()
+        
         return reminder_id
     
-    def get_user_reminders(self, user_id: int) -> List[Dict]:
-        conn = sqlite3.connect(self.db_path)
+    def add_recipient(self, reminder_id: int, chat_id: int, source_chat_id: int) -> bool:
+        # Подписаться можно только на активное напоминание того чата, где введена команда
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT id, message, reminder_time, frequency, is_active, created_at
-            FROM reminders 
-            WHERE user_id = ? AND is_active = 1
-            ORDER BY created_at DESC
-        ''', (user_id,))
+            SELECT 1 FROM reminders 
+            WHERE id = ? AND chat_id = ? AND is_active = 1
+        ''', (reminder_id, source_chat_id))
+        
+        found = cursor.fetchone() is not None
+        if found:
+            cursor.execute('''
+                INSERT OR IGNORE INTO reminder_recipients (reminder_id, chat_id)
+                VALUES (?, ?)
+            ''', (reminder_id, chat_id))
+            conn.commit()
+        conn.close()
+        
+        if found:
+            self.blocked_chats.discard(chat_id)
+            self.reminders_changed.set()
+        return found
+    
+    def remove_recipient(self, reminder_id: int, chat_id: int) -> bool:
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            DELETE FROM reminder_recipients 
+            WHERE reminder_id = ? AND chat_id = ?
+        ''', (reminder_id, chat_id))
+        
+        removed = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        
+        return removed
+    
+    def deactivate_chat_reminders(self, cursor, chat_id: int) -> int:
+        # Чат недоступен: гасим напоминания, которые в него адресованы, и отписываем его от чужих
+        cursor.execute('''
+            UPDATE reminders 
+            SET is_active = 0 
+            WHERE COALESCE(chat_id, user_id) = ? AND is_active = 1
+        ''', (chat_id,))
+        
+        deactivated = cursor.rowcount
+        
+        cursor.execute('''
+            DELETE FROM reminder_recipients 
+            WHERE chat_id = ?
+        ''', (chat_id,))
+        
+        return deactivated
+    
+    def load_checkpoint(self) -> Dict[str, str]:
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT key, value FROM scheduler_state')
+        checkpoint = dict(cursor.fetchall())
+        
+        conn.close()
+        return checkpoint
+    
+    def save_checkpoint(self, state: Dict[str, object]):
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            INSERT OR REPLACE INTO scheduler_state (key, value, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', [(key, str(value)) for key, value in state.items()])
+        
+        conn.commit()
+        conn.close()
+    
+    def get_storage_report(self) -> List[Dict]:
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'index') AND name NOT LIKE 'sqlite_%'")
+        objects = cursor.fetchall()
+        
+        # dbstat есть не во всех сборках SQLite, без него показываем только число строк
+        try:
+            cursor.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+            sizes = dict(cursor.fetchall())
+        except sqlite3.OperationalError:
+            sizes = {}
+        
+        report = []
+        for name, object_type in objects:
+            rows = None
+            if object_type == 'table':
+                cursor.execute(f'SELECT COUNT(*) FROM "{name}"')
+                rows = cursor.fetchone()[0]
+            report.append({
+                'name': name,
+                'type': object_type,
+                'rows': rows,
+                'bytes': sizes.get(name)
+            })
+        
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        freelist_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        
+        report.append({
+            'name': 'database',
+            'type': 'file',
+            'rows': None,
+            'bytes': page_count * page_size,
+            'free_bytes': freelist_count * page_size
+        })
+        
+        conn.close()
+        return report
+    
+    def get_user_reminders(self, user_id: int, chat_id: Optional[int] = None) -> List[Dict]:
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        if chat_id is None:
+            cursor.execute('''
+                SELECT id, message, reminder_time, frequency, is_active, created_at
+                FROM reminders 
+                WHERE user_id = ? AND chat_id IS NULL AND is_active = 1
+                ORDER BY created_at DESC
+            ''', (user_id,))
+        else:
+            # В группе показываем все напоминания этого чата, а не только свои
+            cursor.execute('''
+                SELECT id, message, reminder_time, frequency, is_active, created_at
+                FROM reminders 
+                WHERE chat_id = ? AND is_active = 1
+                ORDER BY created_at DESC
+            ''', (chat_id,))
         
         reminders = []
         for row in cursor.fetchall():
@@ -105,7 +731,7 @@ class ReminderBot:
         return reminders
     
     def delete_reminder(self, reminder_id: int, user_id: int) -> bool:
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -114,6 +740,8 @@ class ReminderBot:
         ''', (reminder_id, user_id))
         
         deleted = cursor.rowcount > 0
+        if deleted:
+            cursor.execute('DELETE FROM reminder_recipients WHERE reminder_id = ?', (reminder_id,))
         conn.commit()
         conn.close()
         
@@ -133,9 +761,14 @@ class ReminderBot:
         ]
         
         periodic_patterns = [
+            r'каждые (\d+) (дня|дней) в (\d{1,2}):(\d{2})',
+            r'каждые (\d+) (недели|недель) в (\d{1,2}):(\d{2})',
+            r'каждое (\d{1,2}) число в (\d{1,2}):(\d{2})',
+            r'каждый месяц (\d{1,2}) числа в (\d{1,2}):(\d{2})',
+            WEEKDAY_LIST_PATTERN,
             r'каждый день в (\d{1,2}):(\d{2})',
-            r'(\d+) раз в день',
-            r'(\d+) раз в неделю в (\d{1,2}):(\d{2})',
+            r'(\d+) раза? в день',
+            r'(\d+) раза? в неделю в (\d{1,2}):(\d{2})',
             r'по будням в (\d{1,2}):(\d{2})',
             r'по выходным в (\d{1,2}):(\d{2})',
             r'по (понедельник|вторник|среда|четверг|пятница|суббота|воскресенье) в (\d{1,2}):(\d{2})',
@@ -147,7 +780,11 @@ class ReminderBot:
         for pattern in periodic_patterns:
             match = re.search(pattern, time_str)
             if match:
-                return self._parse_periodic_reminder(match, pattern)
+                result = self._parse_periodic_reminder(match, pattern)
+                until_match = re.search(r'до (\d{1,2})\.(\d{1,2})\.(\d{4})', time_str)
+                if result and until_match:
+                    return self._with_end_date(result, until_match)
+                return result
         
         for pattern in once_patterns:
             match = re.search(pattern, time_str)
@@ -162,7 +799,7 @@ class ReminderBot:
             unit = match.group(2)
             
             moscow_tz = pytz.timezone('Europe/Moscow')
-            now = datetime.now(moscow_tz)
+            now = self.clock.now(moscow_tz)
             if 'минут' in unit:
                 reminder_time = now + timedelta(minutes=amount)
             elif 'час' in unit:
@@ -172,7 +809,7 @@ class ReminderBot:
             
             return {
                 'type': 'once',
-                'time': reminder_time.strftime('%Y-%m-%d %H:%M'),
+                'time': reminder_time.strftime('%Y-%m-%d %H:%M:%S'),
                 'frequency': 'once'
             }
         
@@ -180,7 +817,7 @@ class ReminderBot:
             hour = int(match.group(1))
             minute = int(match.group(2))
             moscow_tz = pytz.timezone('Europe/Moscow')
-            tomorrow = datetime.now(moscow_tz) + timedelta(days=1)
+            tomorrow = self.clock.now(moscow_tz) + timedelta(days=1)
             reminder_time = tomorrow.replace(hour=hour, minute=minute, second=0, microsecond=0)
             
             return {
@@ -193,7 +830,7 @@ class ReminderBot:
             hour = int(match.group(1))
             minute = int(match.group(2))
             moscow_tz = pytz.timezone('Europe/Moscow')
-            today = datetime.now(moscow_tz)
+            today = self.clock.now(moscow_tz)
             reminder_time = today.replace(hour=hour, minute=minute, second=0, microsecond=0)
             
             if reminder_time <= today:
@@ -233,11 +870,11 @@ class ReminderBot:
             
             try:
                 moscow_tz = pytz.timezone('Europe/Moscow')
-                current_year = datetime.now(moscow_tz).year
+                current_year = self.clock.now(moscow_tz).year
                 reminder_time = datetime(current_year, month, day, hour, minute)
                 reminder_time = moscow_tz.localize(reminder_time)
                 
-                if reminder_time < datetime.now(moscow_tz):
+                if reminder_time < self.clock.now(moscow_tz):
                     reminder_time = reminder_time.replace(year=current_year + 1)
                 
                 return {
@@ -250,8 +887,95 @@ class ReminderBot:
         
         return None
     
+    def _with_end_date(self, result: Dict, until_match) -> Optional[Dict]:
+        # Отдельный экземпляр правила: объекты из get_recurrence общие и не меняются
+        rule = RecurrenceRule.parse(result['frequency'], result['time'])
+        if rule is None:
+            # Без правила дату окончания некуда записать - не теряем её молча
+            return None
+        
+        try:
+            day, month, year = (int(value) for value in until_match.groups())
+            rule.until = datetime(year, month, day).date()
+        except ValueError:
+            return None
+        
+        # Дата окончания в прошлом: такое напоминание ни разу не сработает
+        if rule.until < self.clock.now(pytz.timezone('Europe/Moscow')).date():
+            return None
+        
+        result['frequency'] = rule.to_rrule()
+        return result
+    
     def _parse_periodic_reminder(self, match, pattern):
-        if 'каждый день' in pattern:
+        moscow_tz = pytz.timezone('Europe/Moscow')
+        
+        if 'каждые' in pattern:
+            interval = int(match.group(1))
+            hour = int(match.group(3))
+            minute = int(match.group(4))
+            today = self.clock.now(moscow_tz).date()
+            
+            if interval < 1:
+                return None
+            
+            try:
+                at = datetime.min.replace(hour=hour, minute=minute).time()
+            except ValueError:
+                return None
+            
+            if 'дн' in pattern:
+                rule = RecurrenceRule('DAILY', [at], interval, start=today)
+            else:
+                rule = RecurrenceRule('WEEKLY', [at], interval, weekdays=[today.weekday()], start=today)
+            
+            return {
+                'type': 'periodic',
+                'time': f"{hour:02d}:{minute:02d}",
+                'frequency': rule.to_rrule()
+            }
+        
+        elif 'число' in pattern or 'числа' in pattern:
+            month_day = int(match.group(1))
+            hour = int(match.group(2))
+            minute = int(match.group(3))
+            
+            if not 1 <= month_day <= 31:
+                return None
+            
+            try:
+                at = datetime.min.replace(hour=hour, minute=minute).time()
+            except ValueError:
+                return None
+            
+            rule = RecurrenceRule('MONTHLY', [at], month_days=[month_day])
+            
+            return {
+                'type': 'periodic',
+                'time': f"{hour:02d}:{minute:02d}",
+                'frequency': rule.to_rrule()
+            }
+        
+        elif pattern == WEEKDAY_LIST_PATTERN:
+            short_days = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
+            weekdays = [short_days.index(day.strip()) for day in match.group(1).split(',')]
+            hour = int(match.group(2))
+            minute = int(match.group(3))
+            
+            try:
+                at = datetime.min.replace(hour=hour, minute=minute).time()
+            except ValueError:
+                return None
+            
+            rule = RecurrenceRule('WEEKLY', [at], weekdays=weekdays)
+            
+            return {
+                'type': 'periodic',
+                'time': f"{hour:02d}:{minute:02d}",
+                'frequency': rule.to_rrule()
+            }
+        
+        elif 'каждый день' in pattern:
             hour = int(match.group(1))
             minute = int(match.group(2))
             
@@ -261,20 +985,26 @@ class ReminderBot:
                 'frequency': 'daily'
             }
         
-        elif 'раз в день' in pattern:
+        elif 'в день' in pattern:
             times_per_day = int(match.group(1))
             
+            if times_per_day < 1:
+                return None
+            
             return {
                 'type': 'periodic',
                 'time': '09:00',
                 'frequency': f'{times_per_day}_times_daily'
             }
         
-        elif 'раз в неделю' in pattern:
+        elif 'в неделю' in pattern:
             times_per_week = int(match.group(1))
             hour = int(match.group(2))
             minute = int(match.group(3))
             
+            if times_per_week < 1:
+                return None
+            
             return {
                 'type': 'periodic',
                 'time': f"{hour:02d}:{minute:02d}",
@@ -332,7 +1062,219 @@ class ReminderBot:
         
         return None
 
-bot = ReminderBot("YOUR_BOT_TOKEN_HERE")
+# Создаётся в main() после проверки BOT_TOKEN, чтобы импорт модуля не трогал базу
+bot: Optional[ReminderBot] = None
+
+# Ограничение Telegram на длину одного сообщения, в единицах UTF-16
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Режем с запасом: Markdown-разметка и служебные символы тоже съедают лимит
+MESSAGE_CHUNK_LIMIT = 4000
+
+# Шаблоны - однострочные f-строки: они компилируются вместе с модулем и собирают блок
+# за одну операцию, без цепочки += и повторного разбора строки формата
+def _list_item(index, message, reminder_time, frequency, created_at) -> str:
+    return f"{index}. {message}\n   ⏰ {reminder_time}\n   🔄 {frequency}\n   📅 Создано: {created_at}\n\n"
+
+def _debug_item(reminder_id, message, reminder_time, frequency, is_active, created_at, last_sent) -> str:
+    return (
+        f"🆔 ID: {reminder_id}\n"
+        f"📝 Сообщение: {message}\n"
+        f"⏰ Время: {reminder_time}\n"
+        f"🔄 Частота: {frequency}\n"
+        f"✅ Активно: {bool(is_active)}\n"
+        f"📅 Создано: {created_at}\n"
+        f"📤 Последняя отправка: {last_sent or 'Никогда'}\n\n"
+    )
+
+def _admin_item(reminder_id, user_id, message, reminder_time, frequency, is_active, created_at, last_sent) -> str:
+    return (
+        f"🆔 ID: {reminder_id}\n"
+        f"👤 Пользователь: {user_id}\n"
+        f"📝 Сообщение: {message}\n"
+        f"⏰ Время: {reminder_time}\n"
+        f"🔄 Частота: {frequency}\n"
+        f"✅ Активно: {bool(is_active)}\n"
+        f"📅 Создано: {created_at}\n"
+        f"📤 Последняя отправка: {last_sent or 'Никогда'}\n\n"
+    )
+
+_WEEKDAY_SHORT = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
+_WEEKDAY_PLURAL = {
+    'monday': 'по понедельникам',
+    'tuesday': 'по вторникам',
+    'wednesday': 'по средам',
+    'thursday': 'по четвергам',
+    'friday': 'по пятницам',
+    'saturday': 'по субботам',
+    'sunday': 'по воскресеньям'
+}
+_SIMPLE_FREQUENCIES = {
+    'once': 'разово',
+    'daily': 'каждый день',
+    'weekdays': 'по будням',
+    'weekends': 'по выходным',
+    **_WEEKDAY_PLURAL
+}
+
+def plural(count: int, forms: tuple) -> str:
+    # forms: (1 день, 2 дня, 5 дней)
+    if count % 10 == 1 and count % 100 != 11:
+        return forms[0]
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return forms[1]
+    return forms[2]
+
+@functools.lru_cache(maxsize=1024)
+def describe_frequency(frequency: str, reminder_time: str = '') -> str:
+    if frequency in _SIMPLE_FREQUENCIES:
+        return _SIMPLE_FREQUENCIES[frequency]
+    
+    rule = get_recurrence(frequency, reminder_time) if reminder_time else None
+    if rule is None:
+        return frequency
+    
+    times = ', '.join(at.strftime('%H:%M') for at in rule.times)
+    days = ', '.join(_WEEKDAY_SHORT[day] for day in sorted(rule.weekdays)) if rule.weekdays is not None else ''
+    
+    if frequency.endswith('_times_daily'):
+        count = int(frequency.split('_')[0])
+        return f"{count} {plural(count, ('раз', 'раза', 'раз'))} в день ({times})"
+    
+    if frequency.endswith('_times_weekly'):
+        count = int(frequency.split('_')[0])
+        return f"{count} {plural(count, ('раз', 'раза', 'раз'))} в неделю ({days})"
+    
+    interval = rule.interval
+    if rule.freq == 'DAILY':
+        text = "каждый день" if interval == 1 else f"каждые {interval} {plural(interval, ('день', 'дня', 'дней'))}"
+    elif rule.freq == 'WEEKLY':
+        text = f"по {days}" if interval == 1 else f"каждые {interval} {plural(interval, ('неделю', 'недели', 'недель'))} ({days})"
+    else:
+        month_days = sorted(rule.month_days or [])
+        day_text = ', '.join('последний день' if day == -1 else f"{day} число" for day in month_days)
+        text = f"каждый месяц: {day_text}" if interval == 1 else f"каждые {interval} {plural(interval, ('месяц', 'месяца', 'месяцев'))}: {day_text}"
+    
+    if len(rule.times) > 1:
+        text += f" в {times}"
+    if rule.until:
+        text += f" до {rule.until.strftime('%d.%m.%Y')}"
+    return text
+
+def utf16_len(text: str) -> int:
+    # Telegram считает длину в UTF-16: эмодзи вне BMP занимают две единицы
+    return len(text.encode('utf-16-le')) // 2
+
+def _split_oversized(text: str, limit: int) -> List[str]:
+    pieces = []
+    start = size = 0
+    for i, char in enumerate(text):
+        width = 2 if ord(char) > 0xFFFF else 1
+        if size + width > limit:
+            pieces.append(text[start:i])
+            start, size = i, 0
+        size += width
+    pieces.append(text[start:])
+    return pieces
+
+def chunk_messages(header: str, blocks: List[str], footer: str = '', limit: int = MESSAGE_CHUNK_LIMIT) -> List[str]:
+    # Заголовок всегда уходит вместе с первым блоком; блоки не разрываются между сообщениями,
+    # пока каждый помещается в лимит
+    chunks = []
+    current = []
+    size = 0
+    
+    for block in blocks + [footer] if footer else blocks:
+        if not chunks and not current:
+            block = header + block
+        block_size = utf16_len(block)
+        
+        if current and size + block_size > limit:
+            chunks.append(''.join(current))
+            current, size = [], 0
+        
+        if block_size > limit:
+            pieces = _split_oversized(block, limit)
+            chunks.extend(pieces[:-1])
+            block = pieces[-1]
+            block_size = utf16_len(block)
+        current.append(block)
+        size += block_size
+    
+    if current:
+        chunks.append(''.join(current))
+    return chunks or ([header] if header else [])
+
+@functools.lru_cache(maxsize=1024)
+def _frequency_label(frequency: str, reminder_time: str) -> str:
+    # Для отладки и админки: человекочитаемое описание и исходный код частоты
+    return f"{describe_frequency(frequency, reminder_time)} ({frequency})"
+
+def render_reminder_list(reminders: List[Dict]) -> List[str]:
+    blocks = [
+        _list_item(
+            i,
+            reminder['message'],
+            reminder['reminder_time'],
+            describe_frequency(reminder['frequency'], reminder['reminder_time']),
+            reminder['created_at']
+        )
+        for i, reminder in enumerate(reminders, 1)
+    ]
+    return chunk_messages("📋 **Ваши напоминания:**\n\n", blocks)
+
+def render_debug(rows: List[tuple]) -> List[str]:
+    blocks = [
+        _debug_item(reminder_id, message, reminder_time, _frequency_label(frequency, reminder_time), is_active, created_at, last_sent)
+        for reminder_id, message, reminder_time, frequency, is_active, created_at, last_sent in rows
+    ]
+    return chunk_messages("🔍 **Отладка базы данных:**\n\n", blocks)
+
+def render_admin(rows: List[tuple]) -> List[str]:
+    blocks = [
+        _admin_item(reminder_id, user_id, message, reminder_time, _frequency_label(frequency, reminder_time), is_active, created_at, last_sent)
+        for reminder_id, user_id, message, reminder_time, frequency, is_active, created_at, last_sent in rows
+    ]
+    return chunk_messages("🔐 **Админская панель - Все напоминания:**\n\n", blocks)
+
+def render_created(reminder_id: int, message: str, reminder_time: str, frequency: str) -> str:
+    return (
+        f"✅ Напоминание создано!\n\n"
+        f"📝 Текст: {message}\n"
+        f"⏰ Время: {reminder_time}\n"
+        f"🔄 Периодичность: {describe_frequency(frequency, reminder_time)}\n"
+        f"🆔 ID: {reminder_id}"
+    )
+
+def render_reminder(message: str, frequency: str) -> str:
+    if frequency == 'once':
+        return f"🔔 Напоминание!\n\n{message}\n\n✅ Разовое напоминание выполнено и перенесено в архив."
+    return f"🔔 Напоминание!\n\n{message}"
+
+async def reply_chunks(update: Update, chunks: List[str]):
+    for chunk in chunks:
+        await update.message.reply_text(chunk)
+
+GROUP_CHAT_TYPES = ('group', 'supergroup')
+
+# "Напомни мне ...", а в группах ещё "Напомни нам ..." и "Напомни всем ..."
+REMIND_PREFIX = re.compile(r'^\s*напомни(\s+(мне|нам|всем))?[\s,:]+', re.IGNORECASE)
+
+def group_chat_id(update: Update) -> Optional[int]:
+    chat = update.effective_chat
+    return chat.id if chat and chat.type in GROUP_CHAT_TYPES else None
+
+def strip_bot_mention(text: str, username: Optional[str]) -> Optional[str]:
+    # Текст без обращения к боту или None, если сообщение адресовано не ему
+    if not username:
+        return None
+    mention = f"@{username}"
+    if text.lower().startswith(mention.lower()):
+        return text[len(mention):].lstrip(' ,:')
+    return None
+
+def is_reply_to_bot(update: Update, bot_id: int) -> bool:
+    reply = update.message.reply_to_message
+    return bool(reply and reply.from_user and reply.from_user.id == bot_id)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     welcome_text = """
@@ -352,6 +1294,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • По будням: "по будням в 18:00"
 • По выходным: "по выходным в 10:00"
 • По дням недели: "по понедельник в 14:00", "каждый пт в 16:30"
+• Несколько дней недели: "по пн, ср, пт в 08:00"
+• С интервалом: "каждые 2 дня в 10:00", "каждые 2 недели в 19:00"
+• Ежемесячно: "каждое 15 число в 12:00"
+• До даты: "каждый день в 09:00 до 31.12.2025"
 
 **Команды:**
 /list - показать все напоминания
@@ -361,6 +1307,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /test - создать тестовое напоминание
 /debug - отладка базы данных
 
+👥 **В группах:** добавьте бота в чат и напишите "Напомни нам [текст] [время]" - напоминание придёт всей группе.
+
 Начните с создания первого напоминания! 🚀
     """
     await update.message.reply_text(welcome_text)
@@ -381,6 +1329,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • "Напомни мне пить воду 5 раз в день"
 • "Напомни мне тренировку по понедельник в 18:00"
 • "Напомни мне звонок каждый пт в 16:00"
+• "Напомни мне зарядку по пн, ср, пт в 07:30"
+• "Напомни мне полить цветы каждые 3 дня в 10:00"
+• "Напомни мне оплатить квартиру каждое 10 число в 12:00"
+• "Напомни мне пить витамины каждый день в 09:00 до 31.12.2025"
 
 **Команды:**
 /start - начать работу с ботом
@@ -389,33 +1341,39 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /timezone - настроить часовой пояс
 /test - создать тестовое напоминание
 /debug - отладка базы данных
+/subscribe [ID] - получать напоминание группы лично
+/unsubscribe [ID] - отписаться от напоминания
 /help - показать эту справку
 
+**Группы:**
+• "Напомни нам созвон по будням в 10:00" - напоминание придёт в группу
+• "Напомни мне ..." в группе - напоминание придёт вам лично
+• К боту можно обратиться через @упоминание или ответом на его сообщение
+• /list и /delete в группе работают с напоминаниями этого чата
+
 **Типы напоминаний:**
 • Разовые - срабатывают один раз
 • Ежедневные - каждый день в указанное время
 • Периодические - несколько раз в день/неделю
 • По дням недели - только в будни или выходные
 • По конкретным дням - понедельник, вторник, среда, четверг, пятница, суббота, воскресенье
+• С интервалом и ежемесячные - каждые N дней/недель, в определённое число месяца, с датой окончания
     """
     await update.message.reply_text(help_text)
 
 async def list_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    reminders = bot.get_user_reminders(user_id)
+    chat_id = group_chat_id(update)
+    reminders = bot.get_user_reminders(user_id, chat_id)
     
     if not reminders:
-        await update.message.reply_text("📭 У вас пока нет активных напоминаний.")
+        if chat_id is None:
+            await update.message.reply_text("📭 У вас пока нет активных напоминаний.")
+        else:
+            await update.message.reply_text("📭 В этом чате пока нет активных напоминаний.")
         return
     
-    text = "📋 **Ваши напоминания:**\n\n"
-    for i, reminder in enumerate(reminders, 1):
-        text += f"{i}. {reminder['message']}\n"
-        text += f"   ⏰ {reminder['reminder_time']}\n"
-        text += f"   🔄 {reminder['frequency']}\n"
-        text += f"   📅 Создано: {reminder['created_at']}\n\n"
-    
-    await update.message.reply_text(text)
+    await reply_chunks(update, render_reminder_list(reminders))
 
 async def delete_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -426,7 +1384,8 @@ async def delete_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         reminder_num = int(context.args[0])
-        reminders = bot.get_user_reminders(user_id)
+        chat_id = group_chat_id(update)
+        reminders = bot.get_user_reminders(user_id, chat_id)
         
         if reminder_num < 1 or reminder_num > len(reminders):
             await update.message.reply_text("❌ Неверный номер напоминания.")
@@ -437,12 +1396,45 @@ async def delete_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if success:
             await update.message.reply_text(f"✅ Напоминание #{reminder_num} удалено.")
+        elif chat_id is not None:
+            await update.message.reply_text("❌ Удалить напоминание группы может только его автор.")
         else:
             await update.message.reply_text("❌ Ошибка при удалении напоминания.")
             
     except ValueError:
         await update.message.reply_text("❌ Номер напоминания должен быть числом.")
 
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = group_chat_id(update)
+    
+    if chat_id is None:
+        await update.message.reply_text("❌ Подписаться на напоминание можно только в группе, где оно создано.")
+        return
+    
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("❌ Укажите ID напоминания.\nПример: /subscribe 42")
+        return
+    
+    reminder_id = int(context.args[0])
+    if bot.add_recipient(reminder_id, user_id, chat_id):
+        await update.message.reply_text(f"✅ Напоминание #{reminder_id} будет приходить вам в личные сообщения.\nЕсли вы ещё не писали боту, откройте с ним чат и нажмите /start.")
+    else:
+        await update.message.reply_text("❌ В этом чате нет активного напоминания с таким ID.")
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("❌ Укажите ID напоминания.\nПример: /unsubscribe 42")
+        return
+    
+    reminder_id = int(context.args[0])
+    if bot.remove_recipient(reminder_id, user_id):
+        await update.message.reply_text(f"✅ Вы отписались от напоминания #{reminder_id}.")
+    else:
+        await update.message.reply_text("❌ Вы не подписаны на это напоминание.")
+
 async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -487,11 +1479,11 @@ async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # Создаем тестовое напоминание на 1 минуту вперед (в московском времени)
         moscow_tz = pytz.timezone('Europe/Moscow')
-        test_time = datetime.now(moscow_tz) + timedelta(minutes=1)
+        test_time = bot.clock.now(moscow_tz) + timedelta(minutes=1)
         reminder_id = bot.add_reminder(
             user_id, 
             "🧪 Тестовое напоминание", 
-            test_time.strftime('%Y-%m-%d %H:%M'), 
+            test_time.strftime('%Y-%m-%d %H:%M:%S'), 
             'once'
         )
         
@@ -510,7 +1502,7 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     try:
-        conn = sqlite3.connect(bot.db_path)
+        conn = bot.connect()
         cursor = conn.cursor()
         
         # Получаем все напоминания пользователя
@@ -529,18 +1521,7 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("📭 У вас нет напоминаний в базе данных.")
             return
         
-        text = "🔍 **Отладка базы данных:**\n\n"
-        for reminder in reminders:
-            reminder_id, message, reminder_time, frequency, is_active, created_at, last_sent = reminder
-            text += f"🆔 ID: {reminder_id}\n"
-            text += f"📝 Сообщение: {message}\n"
-            text += f"⏰ Время: {reminder_time}\n"
-            text += f"🔄 Частота: {frequency}\n"
-            text += f"✅ Активно: {bool(is_active)}\n"
-            text += f"📅 Создано: {created_at}\n"
-            text += f"📤 Последняя отправка: {last_sent or 'Никогда'}\n\n"
-        
-        await update.message.reply_text(text)
+        await reply_chunks(update, render_debug(reminders))
         
     except Exception as e:
         await update.message.reply_text(f"❌ Ошибка при отладке: {e}")
@@ -553,8 +1534,55 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Неверная команда.")
         return
     
+    subcommand = context.args[1].lower() if len(context.args) > 1 else None
+    
+    if subcommand == 'profile':
+        if not profiler.enabled:
+            await update.message.reply_text("ℹ️ Профилирование выключено. Запустите бота с PROFILING=1.")
+            return
+        lines = [f"{line}\n" for line in profiler.report().split("\n")]
+        await reply_chunks(update, chunk_messages("⏱ Профилирование:\n\n", lines))
+        return
+    
+    if subcommand == 'cprofile':
+        previous_report = profiler.last_cprofile_report
+        profiler.cprofile_requested = True
+        # Будим планировщик и требуем полный проход, иначе снимок ждал бы ближайшего дедлайна
+        bot.reminders_changed.set()
+        header = ("📸 Снимок cProfile снимается на ближайшем полном проходе планировщика.\n"
+                  "Профилируется только проверка напоминаний - обработчики команд и отправка в него не входят.")
+        if not previous_report:
+            await update.message.reply_text(header)
+            return
+        lines = [f"{line}\n" for line in previous_report.split("\n")]
+        await reply_chunks(update, chunk_messages(f"{header}\n\nПредыдущий снимок:\n", lines))
+        return
+    
+    if subcommand == 'lateness':
+        await update.message.reply_text(
+            f"⏱ Опоздание напоминаний\n\n"
+            f"Постановка в очередь: {fire_lateness.report()}\n"
+            f"Отправка: {delivery_lateness.report()}"
+        )
+        return
+    
+    if subcommand == 'storage':
+        lines = []
+        for entry in bot.get_storage_report():
+            size = f"{entry['bytes'] / 1024:.1f} КБ" if entry['bytes'] is not None else "н/д"
+            rows = f", строк: {entry['rows']}" if entry['rows'] is not None else ""
+            free = f", свободно: {entry['free_bytes'] / 1024:.1f} КБ" if 'free_bytes' in entry else ""
+            lines.append(f"• {entry['name']} ({entry['type']}): {size}{rows}{free}\n")
+        await reply_chunks(update, chunk_messages("💾 Размер базы данных:\n\n", lines))
+        return
+    
+    if subcommand == 'threads':
+        lines = [f"{line}\n" for line in profiler.sample_threads().split("\n")]
+        await reply_chunks(update, chunk_messages("🧵 Стеки потоков:\n\n", lines))
+        return
+    
     try:
-        conn = sqlite3.connect(bot.db_path)
+        conn = bot.connect()
         cursor = conn.cursor()
         
         # Получаем все напоминания всех пользователей
@@ -572,24 +1600,7 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("📭 В боте нет напоминаний.")
             return
         
-        text = "🔐 **Админская панель - Все напоминания:**\n\n"
-        for reminder in reminders:
-            reminder_id, user_id, message, reminder_time, frequency, is_active, created_at, last_sent = reminder
-            text += f"🆔 ID: {reminder_id}\n"
-            text += f"👤 Пользователь: {user_id}\n"
-            text += f"📝 Сообщение: {message}\n"
-            text += f"⏰ Время: {reminder_time}\n"
-            text += f"🔄 Частота: {frequency}\n"
-            text += f"✅ Активно: {bool(is_active)}\n"
-            text += f"📅 Создано: {created_at}\n"
-            text += f"📤 Последняя отправка: {last_sent or 'Никогда'}\n\n"
-            
-            # Ограничиваем длину сообщения
-            if len(text) > 3500:
-                text += "... (показаны первые 50 напоминаний)"
-                break
-        
-        await update.message.reply_text(text)
+        await reply_chunks(update, render_admin(reminders))
         
     except Exception as e:
         await update.message.reply_text(f"❌ Ошибка при получении данных: {e}")
@@ -597,14 +1608,33 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     message_text = update.message.text
+    chat_id = group_chat_id(update)
+    
+    # В группе отвечаем только на обращения: упоминание, ответ на сообщение бота или "Напомни ..."
+    addressed = chat_id is None
+    if chat_id is not None:
+        stripped = strip_bot_mention(message_text, context.bot.username)
+        if stripped is not None:
+            message_text = stripped
+            addressed = True
+        elif is_reply_to_bot(update, context.bot.id):
+            addressed = True
     
-    if message_text.lower().startswith('напомни мне'):
-        reminder_text = message_text[12:].strip()
+    prefix = REMIND_PREFIX.match(message_text)
+    if prefix:
+        reminder_text = message_text[prefix.end():].strip()
+        # "Напомни мне" в группе - личное напоминание автору, "нам"/"всем" - всей группе
+        target_chat_id = None if (prefix.group(2) or '').lower() == 'мне' else chat_id
         time_info = bot.parse_time_input(reminder_text)
         
         if time_info:
             text_without_time = reminder_text
             for pattern in [
+                r'\s+каждые\s+\d+\s+(дня|дней|недели|недель)\s+в\s+\d{1,2}:\d{2}',
+                r'\s+каждое\s+\d{1,2}\s+число\s+в\s+\d{1,2}:\d{2}',
+                r'\s+каждый\s+месяц\s+\d{1,2}\s+числа\s+в\s+\d{1,2}:\d{2}',
+                r'\s+по\s+(пн|вт|ср|чт|пт|сб|вс)(\s*,\s*(пн|вт|ср|чт|пт|сб|вс))+\s+в\s+\d{1,2}:\d{2}',
+                r'\s+до\s+\d{1,2}\.\d{1,2}\.\d{4}',
                 r'\s+через\s+\d+\s+(минут|час|часа|часов|день|дня|дней)',
                 r'\s+в\s+\d{1,2}:\d{2}',
                 r'\s+завтра\s+в\s+\d{1,2}:\d{2}',
@@ -613,7 +1643,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 r'\s+\d{1,2}/\d{1,2}/\d{4}\s+в\s+\d{1,2}:\d{2}',
                 r'\s+\d{1,2}/\d{1,2}\s+в\s+\d{1,2}:\d{2}',
                 r'\s+каждый\s+день\s+в\s+\d{1,2}:\d{2}',
-                r'\s+\d+\s+раз\s+в\s+(день|неделю)',
+                r'\s+\d+\s+раза?\s+в\s+(день|неделю)',
                 r'\s+по\s+(будням|выходным)\s+в\s+\d{1,2}:\d{2}'
             ]:
                 text_without_time = re.sub(pattern, '', text_without_time, flags=re.IGNORECASE)
@@ -625,104 +1655,368 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     user_id, 
                     reminder_message, 
                     time_info['time'], 
-                    time_info['frequency']
+                    time_info['frequency'],
+                    target_chat_id
                 )
                 
-                response = f"✅ Напоминание создано!\n\n"
-                response += f"📝 Текст: {reminder_message}\n"
-                response += f"⏰ Время: {time_info['time']}\n"
-                response += f"🔄 Периодичность: {time_info['frequency']}\n"
-                response += f"🆔 ID: {reminder_id}"
-                
-                await update.message.reply_text(response)
-            else:
+                reply = render_created(reminder_id, reminder_message, time_info['time'], time_info['frequency'])
+                if target_chat_id is not None:
+                    reply += f"\n\n👥 Напоминание придёт в этот чат. Получать его ещё и лично: /subscribe {reminder_id}"
+                elif chat_id is not None:
+                    reply += "\n\n🔒 Напоминание придёт вам в личные сообщения. Если вы ещё не писали боту, откройте с ним чат и нажмите /start."
+                await update.message.reply_text(reply)
+            elif addressed:
                 await update.message.reply_text("❌ Не удалось определить текст напоминания.")
-        else:
+        elif addressed:
+            # Обычная реплика в группе, начавшаяся с "Напомни", не должна получать ошибку разбора
             await update.message.reply_text("❌ Не удалось распознать время напоминания.\n\nПримеры:\n• в 15:30\n• завтра в 10:00\n• 9.10.2025 в 12:00\n• 15.03 в 14:30\n• каждый день в 09:00\n• через 2 часа")
-    else:
+    elif addressed:
         await update.message.reply_text("🤖 Для создания напоминания используйте формат:\n\"Напомни мне [текст] [время]\"\n\nИли используйте команду /help для получения справки.")
 
+# Результаты попытки отправки напоминания
+SEND_OK = 'sent'
+SEND_BLOCKED = 'blocked'
+SEND_RETRY = 'retry'
+SEND_FAILED = 'failed'
+
+# Запас к дедлайну, чтобы не проснуться на доли миллисекунды раньше срока
+DEADLINE_SLACK = 0.01
+
+# Даже если до ближайшего дедлайна ничего не изменилось, полный проход делается не реже этого (с)
+FULL_SCAN_INTERVAL = 600
+
+# Статусы записей в outbox
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 300
+RETRY_MAX_ATTEMPTS = 5
+
+# Сколько ждать ответа Telegram на одну отправку, прежде чем считать её неудачной
+SEND_TIMEOUT = 30
+
+# Лимиты Telegram: в личный чат ~1 сообщение в секунду, в группу ~20 в минуту, всего ~30 в секунду
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+GLOBAL_SEND_INTERVAL = 1 / 30
+
 class SchedulerManager:
-    def __init__(self, bot_instance, application):
+    def __init__(self, bot_instance, application, tick_interval: float = 30):
         self.bot_instance = bot_instance
         self.application = application
+        self.tick_interval = tick_interval
+        self.clock = bot_instance.clock
         self.running = False
+        self.stop_event = Event()
+        self.thread = None
+        self.last_tick_at = None
+        self.last_enqueued = 0
+        # Напоминания менялись после последнего полного прохода - next_deadline ненадёжен
+        self.reminders_dirty = True
+        self.skipped_ticks = 0
+        # Ближайшее известное время срабатывания (clock.time()), до которого можно спать
+        self.next_deadline = None
         
     def start_scheduler(self):
+        checkpoint = self.bot_instance.load_checkpoint()
+        initial_delay = 0
+        
+        if checkpoint.get('clean_shutdown') == '0':
+            logger.warning("⚠️ Предыдущий процесс завершился аварийно, неотправленные уведомления будут доставлены повторно")
+        
+        if 'last_tick_at' in checkpoint:
+            self.last_tick_at = float(checkpoint['last_tick_at'])
+            # Такт уже прошёл незадолго до перезапуска - не пересчитываем всё сразу
+            initial_delay = max(0, min(self.tick_interval, self.last_tick_at + self.tick_interval - self.clock.time()))
+            logger.info(f"Возобновление с контрольной точки, первый такт через {initial_delay:.1f} с")
+        
+        if checkpoint.get('next_deadline'):
+            self.next_deadline = float(checkpoint['next_deadline'])
+        
+        # После чистой остановки дедлайн из контрольной точки достоверен: до него
+        # проходы по напоминаниям пропускаются. После аварии всё пересчитывается сразу
+        self.reminders_dirty = not (checkpoint.get('clean_shutdown') == '1' and self.next_deadline and self.last_tick_at)
+        if not self.reminders_dirty:
+            logger.info(f"До ближайшего дедлайна через {max(0, self.next_deadline - self.clock.time()):.1f} с полные проходы не нужны")
+        
+        self.bot_instance.save_checkpoint({'clean_shutdown': 0})
+        
         self.running = True
-        scheduler_thread = Thread(target=self._run_scheduler, daemon=True)
-        scheduler_thread.start()
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run_scheduler, args=(initial_delay,), daemon=True)
+        self.thread.start()
         logger.info("Планировщик запущен")
     
-    def _run_scheduler(self):
+    def stop(self, timeout: float) -> bool:
+        # Новые такты не начинаются, текущий дорабатывает и фиксирует транзакцию
+        self.running = False
+        self.stop_event.set()
+        self.bot_instance.reminders_changed.set()
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning("⚠️ Планировщик не остановился за отведённое время")
+                return False
+        logger.info("Планировщик остановлен")
+        return True
+    
+    def checkpoint(self) -> Dict[str, object]:
+        state = {}
+        if self.last_tick_at is not None:
+            state['last_tick_at'] = self.last_tick_at
+        if self.next_deadline is not None:
+            state['next_deadline'] = self.next_deadline
+        return state
+    
+    def _run_scheduler(self, initial_delay: float = 0):
+        wake_event = self.bot_instance.reminders_changed
+        next_tick = time.monotonic() + initial_delay
+        
         while self.running:
+            timeout = self._wake_delay(next_tick - time.monotonic())
+            if timeout > 0:
+                wake_event.wait(timeout)
+            if wake_event.is_set():
+                self.reminders_dirty = True
+            wake_event.clear()
+            
+            if self.stop_event.is_set():
+                break
+            
+            if self._can_skip_tick():
+                self.skipped_ticks += 1
+                next_tick = self._next_grid_tick(next_tick, time.monotonic())
+                continue
+            
             try:
-                self._check_and_send_reminders()
-                time.sleep(30)
+                with profiler.span('scheduler.tick'):
+                    completed = profiler.run_with_cprofile(self._check_and_enqueue_reminders)
+                if completed:
+                    self.last_tick_at = self.clock.time()
+                    self.reminders_dirty = False
             except Exception as e:
                 logger.error(f"Ошибка в планировщике: {e}")
-                time.sleep(60)
+                next_tick = time.monotonic() + 60
+                continue
+            
+            next_tick = self._next_grid_tick(next_tick, time.monotonic())
+    
+    def _can_skip_tick(self) -> bool:
+        # next_deadline - минимум следующих срабатываний по всем напоминаниям на последнем
+        # полном проходе; пока он не наступил и напоминания не менялись, отправлять нечего
+        if self.reminders_dirty or self.next_deadline is None or self.last_tick_at is None:
+            return False
+        now = self.clock.time()
+        return now < self.next_deadline and now - self.last_tick_at < FULL_SCAN_INTERVAL
+    
+    def _wake_delay(self, tick_delay: float) -> float:
+        # Спим до ближайшего дедлайна напоминания, но не дольше следующего такта сетки
+        if self.next_deadline is not None:
+            return min(tick_delay, self.next_deadline - self.clock.time() + DEADLINE_SLACK)
+        return tick_delay
+    
+    def _next_grid_tick(self, next_tick: float, now: float) -> float:
+        # Такты идут по фиксированной сетке: долгий такт не сдвигает все последующие
+        next_tick += self.tick_interval
+        if next_tick <= now:
+            next_tick += self.tick_interval * ((now - next_tick) // self.tick_interval + 1)
+        return next_tick
+    
+    def run_simulated(self, until: float, on_tick=None) -> int:
+        # Те же такты и дедлайны, что в _run_scheduler, но на SimulatedClock:
+        # вместо ожидания часы сразу переводятся к моменту пробуждения
+        next_tick = self.clock.time()
+        ticks = 0
+        
+        while True:
+            wake_at = self.clock.time() + max(0, self._wake_delay(next_tick - self.clock.time()))
+            if wake_at > until:
+                break
+            self.clock.advance_to(wake_at)
+            
+            if self._can_skip_tick():
+                self.skipped_ticks += 1
+                next_tick = self._next_grid_tick(next_tick, self.clock.time())
+                continue
+            
+            started = time.perf_counter()
+            if self._check_and_enqueue_reminders():
+                self.last_tick_at = self.clock.time()
+                self.reminders_dirty = False
+            ticks += 1
+            if on_tick:
+                on_tick(self, time.perf_counter() - started)
+            
+            next_tick = self._next_grid_tick(next_tick, self.clock.time())
+        
+        return ticks
     
-    def _check_and_send_reminders(self):
-        conn = sqlite3.connect(self.bot_instance.db_path)
+    def _check_and_enqueue_reminders(self):
+        conn = self.bot_instance.connect()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id, user_id, message, reminder_time, frequency, last_sent
-            FROM reminders 
-            WHERE is_active = 1
-        ''')
+        with profiler.span('scheduler.load'):
+            cursor.execute('''
+                SELECT id, user_id, COALESCE(chat_id, user_id), message, reminder_time, frequency, last_sent
+                FROM reminders 
+                WHERE is_active = 1
+            ''')
+            
+            reminders = cursor.fetchall()
+            
+            # Получатели всех напоминаний одним запросом: каждое напоминание оценивается один раз
+            cursor.execute('''
+                SELECT rr.reminder_id, rr.chat_id
+                FROM reminder_recipients rr
+                JOIN reminders r ON r.id = rr.reminder_id
+                WHERE r.is_active = 1
+            ''')
+            
+            recipients = {}
+            for reminder_id, chat_id in cursor.fetchall():
+                recipients.setdefault(reminder_id, []).append(chat_id)
         
-        reminders = cursor.fetchall()
+        blocked_chats = self.bot_instance.blocked_chats
+        next_deadline = None
+        enqueued = 0
+        expired = []
+        
+        completed = True
         
         for reminder in reminders:
-            reminder_id, user_id, message, reminder_time, frequency, last_sent = reminder
+            if self.stop_event.is_set():
+                completed = False
+                break
+            
+            reminder_id, user_id, chat_id, message, reminder_time, frequency, last_sent = reminder
+            
+            chats = [chat for chat in [chat_id] + recipients.get(reminder_id, []) if chat not in blocked_chats]
+            if not chats:
+                continue
             
             try:
                 user_tz = self.bot_instance.get_user_timezone(user_id)
                 tz = pytz.timezone(user_tz)
-                current_time = datetime.now(tz)
+                current_time = self.clock.now(tz)
                 
-                should_send = self._should_send_reminder(reminder_time, frequency, last_sent, current_time, user_id)
+                with profiler.span('scheduler.evaluate', frequency=frequency):
+                    should_send = self._should_send_reminder(reminder_time, frequency, last_sent, current_time, user_id)
                 
                 if should_send:
-                    import asyncio
-                    try:
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        loop.run_until_complete(self._send_reminder(user_id, message, reminder_id, frequency))
-                        loop.close()
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке напоминания {reminder_id}: {e}")
-                        try:
-                            if 'loop' in locals():
-                                loop.close()
-                        except:
-                            pass
-                    
-                    if frequency == 'once':
-                        cursor.execute('''
-                            DELETE FROM reminders 
-                            WHERE id = ?
-                        ''', (reminder_id,))
-                    else:
-                        cursor.execute('''
-                            UPDATE reminders 
-                            SET last_sent = ? 
-                            WHERE id = ?
-                        ''', (current_time.strftime('%Y-%m-%d %H:%M:%S'), reminder_id))
+                    due_time = self._due_time(reminder_time, frequency, current_time)
+                    due_at = due_time.timestamp() if due_time else self.clock.time()
+                    with profiler.span('scheduler.enqueue', reminder_id=reminder_id):
+                        self._enqueue_reminder(cursor, reminder_id, user_id, chats, message, reminder_time, frequency, current_time, due_at)
+                    fire_lateness.record(self.clock.time() - due_at)
+                    enqueued += len(chats)
+                
+                if self._is_expired(reminder_time, frequency, current_time):
+                    expired.append((reminder_id,))
+                    continue
+                
+                # Дедлайн учитывает и только что отправленные напоминания: по нему пропускаются такты
+                next_time = self._next_time(reminder_time, frequency, current_time)
+                if next_time is not None:
+                    deadline = next_time.timestamp()
+                    if next_deadline is None or deadline < next_deadline:
+                        next_deadline = deadline
                     
             except Exception as e:
                 logger.error(f"Ошибка при обработке напоминания {reminder_id}: {e}")
-        
-        conn.commit()
+                # Сломанное напоминание проверяется на каждом такте сетки, как раньше
+                deadline = self.clock.time() + self.tick_interval
+                if next_deadline is None or deadline < next_deadline:
+                    next_deadline = deadline
+        
+        if expired:
+            # Правила с прошедшей датой окончания больше не сработают - их заберёт в архив обслуживание
+            cursor.executemany('UPDATE reminders SET is_active = 0 WHERE id = ?', expired)
+            logger.info(f"Деактивировано напоминаний с истёкшим сроком: {len(expired)}")
+        
+        with profiler.span('scheduler.commit', reminders=len(reminders)):
+            conn.commit()
         conn.close()
+        
+        self.last_enqueued = enqueued
+        if enqueued:
+            self.bot_instance.outbox_ready.set()
+        if completed:
+            self.next_deadline = next_deadline
+        
+        return completed
+    
+    def _due_time(self, reminder_time: str, frequency: str, current_time: datetime) -> Optional[datetime]:
+        # Запланированное время срабатывания, которое наступило к current_time
+        try:
+            if frequency == 'once':
+                return current_time.tzinfo.localize(parse_once_time(reminder_time))
+        except ValueError:
+            return None
+        
+        rule = get_recurrence(frequency, reminder_time)
+        if rule is None:
+            return None
+        occurrence = rule.latest_today(current_time.replace(tzinfo=None))
+        return current_time.tzinfo.localize(occurrence) if occurrence else None
+    
+    def _is_expired(self, reminder_time: str, frequency: str, current_time: datetime) -> bool:
+        if frequency == 'once':
+            return False
+        rule = get_recurrence(frequency, reminder_time)
+        return bool(rule and rule.until and current_time.date() > rule.until)
+    
+    def _next_time(self, reminder_time: str, frequency: str, current_time: datetime) -> Optional[datetime]:
+        # Ближайшее будущее срабатывание - до него планировщик может спать
+        if frequency == 'once':
+            due_time = self._due_time(reminder_time, frequency, current_time)
+            return due_time if due_time and due_time > current_time else None
+        
+        rule = get_recurrence(frequency, reminder_time)
+        if rule is None:
+            return None
+        occurrence = rule.next_after(current_time.replace(tzinfo=None))
+        return current_time.tzinfo.localize(occurrence) if occurrence else None
+    
+    def _enqueue_reminder(self, cursor, reminder_id: int, user_id: int, chats: List[int], message: str, reminder_time: str, frequency: str, current_time: datetime, due_at: float):
+        reminder_text = render_reminder(message, frequency)
+        if frequency == 'once':
+            idempotency_key = f"{reminder_id}:{reminder_time}"
+        else:
+            # Ключ по запланированному срабатыванию: повторная оценка того же слота не даст дубль
+            idempotency_key = f"{reminder_id}:{datetime.fromtimestamp(due_at, current_time.tzinfo).strftime('%Y-%m-%d %H:%M')}"
+        
+        # Уведомление и сдвиг напоминания фиксируются одной транзакцией,
+        # поэтому отправка не теряется, даже если Telegram недоступен.
+        # Личный чат автора сохраняет прежний ключ, остальным чатам добавляется chat_id
+        cursor.executemany('''
+            INSERT OR IGNORE INTO outbox (idempotency_key, reminder_id, user_id, chat_id, text, due_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (idempotency_key if chat == user_id else f"{idempotency_key}:{chat}", reminder_id, user_id, chat, reminder_text, due_at)
+            for chat in chats
+        ])
+        
+        if frequency == 'once':
+            # Выполненное разовое напоминание позже переносится в архив фоновым обслуживанием
+            cursor.execute('''
+                UPDATE reminders 
+                SET is_active = 0, last_sent = ? 
+                WHERE id = ?
+            ''', (current_time.strftime('%Y-%m-%d %H:%M:%S'), reminder_id))
+        else:
+            cursor.execute('''
+                UPDATE reminders 
+                SET last_sent = ? 
+                WHERE id = ?
+            ''', (current_time.strftime('%Y-%m-%d %H:%M:%S'), reminder_id))
     
     def _should_send_reminder(self, reminder_time: str, frequency: str, last_sent: str, current_time: datetime, user_id: int) -> bool:
         if frequency == 'once':
             try:
                 moscow_tz = pytz.timezone('Europe/Moscow')
-                target_time = datetime.strptime(reminder_time, '%Y-%m-%d %H:%M')
+                target_time = parse_once_time(reminder_time)
                 target_time = moscow_tz.localize(target_time)
                 
                 if current_time >= target_time and not last_sent:
@@ -733,172 +2027,491 @@ class SchedulerManager:
                 logger.error(f"Ошибка парсинга времени разового напоминания: {e}")
                 return False
         
-        elif frequency == 'daily':
-            try:
-                target_time = datetime.strptime(reminder_time, '%H:%M').time()
-                current_time_only = current_time.time()
-                
-                if current_time_only >= target_time:
-                    if not last_sent:
-                        return True
-                    
-                    last_sent_dt = datetime.strptime(last_sent, '%Y-%m-%d %H:%M:%S')
-                    return last_sent_dt.date() < current_time.date()
-                
-                return False
-            except:
-                return False
+        rule = get_recurrence(frequency, reminder_time)
+        if rule is None:
+            return False
         
-        elif frequency == 'weekdays':
-            if current_time.weekday() < 5:
-                try:
-                    target_time = datetime.strptime(reminder_time, '%H:%M').time()
-                    current_time_only = current_time.time()
-                    
-                    if current_time_only >= target_time:
-                        if not last_sent:
-                            return True
-                        
-                        last_sent_dt = datetime.strptime(last_sent, '%Y-%m-%d %H:%M:%S')
-                        return last_sent_dt.date() < current_time.date()
-                    
-                    return False
-                except:
-                    return False
+        occurrence = rule.latest_today(current_time.replace(tzinfo=None))
+        if occurrence is None:
             return False
         
-        elif frequency == 'weekends':
-            if current_time.weekday() >= 5:
-                try:
-                    target_time = datetime.strptime(reminder_time, '%H:%M').time()
-                    current_time_only = current_time.time()
-                    
-                    if current_time_only >= target_time:
-                        if not last_sent:
-                            return True
-                        
-                        last_sent_dt = datetime.strptime(last_sent, '%Y-%m-%d %H:%M:%S')
-                        return last_sent_dt.date() < current_time.date()
-                    
-                    return False
-                except:
-                    return False
+        if not last_sent:
+            return True
+        
+        try:
+            return datetime.strptime(last_sent, '%Y-%m-%d %H:%M:%S') < occurrence
+        except ValueError:
             return False
+
+class DeliveryWorker:
+    def __init__(self, bot_instance, application, batch_size: int = 50, poll_interval: float = 5):
+        self.bot_instance = bot_instance
+        self.application = application
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.clock = bot_instance.clock
+        self.running = False
+        self.stop_event = Event()
+        self.thread = None
+        # Когда в чат снова можно писать (clock.time()) и когда ушло последнее сообщение
+        self.chat_ready_at = {}
+        self.last_send_at = 0
+        self.next_wakeup = None
+        # Цикл событий приложения: HTTP-клиент бота привязан к нему, поэтому
+        # отправки из потока выполняются в нём, а не в собственном цикле
+        self.loop = None
+    
+    def attach_loop(self, loop):
+        self.loop = loop
+        self.bot_instance.outbox_ready.set()
+    
+    def start_worker(self):
+        self.running = True
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run_worker, daemon=True)
+        self.thread.start()
+        logger.info("Обработчик отправки запущен")
+    
+    def stop(self, timeout: float) -> bool:
+        # Новые записи не берутся, текущая отправка дожидается ответа Telegram
+        self.running = False
+        self.stop_event.set()
+        self.bot_instance.outbox_ready.set()
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning("⚠️ Обработчик отправки не завершил текущую отправку за отведённое время")
+                return False
+        logger.info("Обработчик отправки остановлен")
+        return True
+    
+    def pending_count(self) -> int:
+        conn = self.bot_instance.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM outbox WHERE status = ?', (OUTBOX_PENDING,))
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
+    def _run_worker(self):
+        outbox_ready = self.bot_instance.outbox_ready
         
-        elif 'times_daily' in frequency:
-            times_per_day = int(frequency.split('_')[0])
+        while self.running:
             try:
-                if not last_sent:
-                    return True
+                outbox_ready.clear()
+                with profiler.span('delivery.batch'):
+                    delivered = self._deliver_pending()
+                if delivered < self.batch_size:
+                    # Планировщик будит обработчик сразу после постановки в outbox,
+                    # опрос по таймеру нужен только для отложенных повторов
+                    timeout = self.poll_interval
+                    if self.next_wakeup is not None:
+                        timeout = max(0, min(timeout, self.next_wakeup - self.clock.time()))
+                    outbox_ready.wait(timeout)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике отправки: {e}")
+                self.stop_event.wait(60)
+    
+    def _retry_delay(self, attempts: int) -> float:
+        # Экспоненциальная задержка с полным джиттером, чтобы повторы не шли пачкой
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempts))
+    
+    def _chat_interval(self, chat_id: int) -> float:
+        # У групп и каналов отрицательный chat_id
+        return GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL
+    
+    def _throttle(self, chat_id: int) -> Optional[float]:
+        # Время, до которого запись в этот чат нужно отложить, или None, если можно отправлять
+        now = self.clock.time()
+        ready_at = self.chat_ready_at.get(chat_id, 0)
+        if ready_at > now:
+            return ready_at
+        
+        wait = self.last_send_at + GLOBAL_SEND_INTERVAL - now
+        if wait > 0:
+            self.stop_event.wait(wait)
+        return None
+    
+    def _record_send(self, chat_id: int):
+        now = self.clock.time()
+        self.last_send_at = now
+        self.chat_ready_at[chat_id] = now + self._chat_interval(chat_id)
+        if len(self.chat_ready_at) > 10000:
+            self.chat_ready_at = {chat: ready_at for chat, ready_at in self.chat_ready_at.items() if ready_at > now}
+    
+    def _deliver_pending(self) -> int:
+        conn = self.bot_instance.connect()
+        cursor = conn.cursor()
+        
+        with profiler.span('delivery.load'):
+            cursor.execute('''
+                SELECT id, idempotency_key, reminder_id, COALESCE(chat_id, user_id), text, attempts, due_at
+                FROM outbox 
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY id
+                LIMIT ?
+            ''', (OUTBOX_PENDING, self.clock.time(), self.batch_size))
+            
+            entries = cursor.fetchall()
+        self.next_wakeup = None
+        if not entries or self.loop is None:
+            # До запуска приложения отправлять не через что - записи подождут в outbox
+            conn.close()
+            return 0
+        
+        blocked_chats = self.bot_instance.blocked_chats
+        reserved = {}
+        
+        try:
+            for outbox_id, idempotency_key, reminder_id, chat_id, text, attempts, due_at in entries:
+                if self.stop_event.is_set():
+                    # Остаток пачки остаётся в outbox и уйдёт после перезапуска
+                    break
                 
-                last_sent_dt = datetime.strptime(last_sent, '%Y-%m-%d %H:%M:%S')
+                if chat_id in blocked_chats:
+                    result, error = SEND_BLOCKED, None
+                else:
+                    ready_at = self._throttle(chat_id)
+                    if ready_at is not None:
+                        # Чат упёрся в лимит: откладываем запись, не расходуя попытку.
+                        # Следующие записи в тот же чат из этой пачки встают за ней
+                        ready_at = max(ready_at, reserved.get(chat_id, 0))
+                        reserved[chat_id] = ready_at + self._chat_interval(chat_id)
+                        cursor.execute('''
+                            UPDATE outbox 
+                            SET next_attempt_at = ?
+                            WHERE id = ?
+                        ''', (ready_at, outbox_id))
+                        conn.commit()
+                        if self.next_wakeup is None or ready_at < self.next_wakeup:
+                            self.next_wakeup = ready_at
+                        continue
+                    
+                    with profiler.span('delivery.send', reminder_id=reminder_id, chat_id=chat_id):
+                        result, error = self._send_in_loop(chat_id, text, reminder_id)
+                    self._record_send(chat_id)
                 
-                if last_sent_dt.date() < current_time.date():
-                    return True
+                if result == SEND_OK:
+                    if due_at is not None:
+                        delivery_lateness.record(self.clock.time() - due_at)
+                    cursor.execute('''
+                        UPDATE outbox 
+                        SET status = ?, attempts = ?, sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                        WHERE id = ?
+                    ''', (OUTBOX_SENT, attempts + 1, outbox_id))
                 
-                conn = sqlite3.connect(self.bot_instance.db_path)
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT COUNT(*) FROM reminders 
-                    WHERE user_id = ? 
-                    AND DATE(last_sent) = DATE(?)
-                    AND frequency = ?
-                ''', (user_id, current_time.strftime('%Y-%m-%d'), frequency))
+                elif result == SEND_BLOCKED:
+                    blocked_chats.add(chat_id)
+                    deactivated = self.bot_instance.deactivate_chat_reminders(cursor, chat_id)
+                    cursor.execute('''
+                        UPDATE outbox 
+                        SET status = ?, last_error = ?
+                        WHERE COALESCE(chat_id, user_id) = ? AND status = ?
+                    ''', (OUTBOX_DEAD, 'blocked', chat_id, OUTBOX_PENDING))
+                    logger.warning(f"⚠️ Деактивировано напоминаний чата {chat_id}: {deactivated}")
                 
-                sent_today = cursor.fetchone()[0]
-                conn.close()
+                elif result == SEND_RETRY and attempts + 1 < RETRY_MAX_ATTEMPTS:
+                    if getattr(error, 'retry_after', None) is not None:
+                        delay = float(error.retry_after)
+                    else:
+                        delay = self._retry_delay(attempts + 1)
+                    cursor.execute('''
+                        UPDATE outbox 
+                        SET attempts = ?, next_attempt_at = ?, last_error = ?
+                        WHERE id = ?
+                    ''', (attempts + 1, self.clock.time() + delay, str(error), outbox_id))
+                    logger.warning(f"⏳ Повторная отправка {idempotency_key} через {delay:.1f} с (попытка {attempts + 1})")
                 
-                return sent_today < times_per_day
+                else:
+                    cursor.execute('''
+                        UPDATE outbox 
+                        SET status = ?, attempts = ?, last_error = ?
+                        WHERE id = ?
+                    ''', (OUTBOX_DEAD, attempts + 1, str(error), outbox_id))
+                    logger.error(f"❌ Уведомление {idempotency_key} перемещено в dead-letter после {attempts + 1} попыток: {error}")
                 
-            except:
-                return False
+                # Фиксируем результат сразу: при падении повторно уйдёт максимум одно сообщение
+                with profiler.span('delivery.commit'):
+                    conn.commit()
+        finally:
+            conn.close()
         
-        elif frequency in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']:
-            day_mapping = {
-                'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-                'friday': 4, 'saturday': 5, 'sunday': 6
-            }
-            
-            target_day = day_mapping[frequency]
-            current_day = current_time.weekday()
-            
-            if current_day == target_day:
-                try:
-                    target_time = datetime.strptime(reminder_time, '%H:%M').time()
-                    current_time_only = current_time.time()
-                    
-                    if current_time_only >= target_time:
-                        if not last_sent:
-                            return True
-                        
-                        last_sent_dt = datetime.strptime(last_sent, '%Y-%m-%d %H:%M:%S')
-                        return last_sent_dt.date() < current_time.date()
-                    
-                    return False
-                except:
-                    return False
-            
-            return False
+        return len(entries)
+    
+    def _send_in_loop(self, chat_id: int, text: str, reminder_id: int):
+        import concurrent.futures
         
-        return False
+        future = asyncio.run_coroutine_threadsafe(self._send_reminder(chat_id, text, reminder_id), self.loop)
+        try:
+            return future.result(SEND_TIMEOUT)
+        except concurrent.futures.TimeoutError as e:
+            future.cancel()
+            logger.warning(f"⚠️ Telegram не ответил за {SEND_TIMEOUT} с при отправке напоминания {reminder_id}")
+            return SEND_RETRY, e
+        except RuntimeError as e:
+            # Цикл приложения уже остановлен - запись останется в outbox
+            return SEND_RETRY, e
     
-    async def _send_reminder(self, user_id: int, message: str, reminder_id: int, frequency: str = None):
+    async def _send_reminder(self, chat_id: int, text: str, reminder_id: int):
+        from telegram.error import Forbidden, BadRequest, RetryAfter, NetworkError
+        
+        if not self.application.bot:
+            logger.error(f"❌ Бот не инициализирован для отправки напоминания {reminder_id}")
+            return SEND_RETRY, None
+        
         try:
-            if frequency == 'once':
-                reminder_text = f"🔔 Напоминание!\n\n{message}\n\n✅ Разовое напоминание выполнено и удалено."
-            else:
-                reminder_text = f"🔔 Напоминание!\n\n{message}"
+            await self.application.bot.send_message(chat_id=chat_id, text=text)
+            logger.info(f"✅ Напоминание {reminder_id} отправлено в чат {chat_id}")
+            return SEND_OK, None
+        
+        except Forbidden as e:
+            logger.warning(f"⚠️ Чат {chat_id} недоступен: бот заблокирован или исключён ({e}). Деактивируем напоминания чата")
+            return SEND_BLOCKED, e
+        
+        except BadRequest as e:
+            # BadRequest наследуется от NetworkError, поэтому проверяется раньше
+            if "chat not found" in str(e).lower():
+                logger.warning(f"⚠️ Чат {chat_id} не найден. Деактивируем напоминания чата")
+                return SEND_BLOCKED, e
+            logger.error(f"❌ Telegram отклонил напоминание {reminder_id} для чата {chat_id}: {e}")
+            return SEND_FAILED, e
+        
+        except RetryAfter as e:
+            logger.warning(f"⚠️ Превышен лимит Telegram при отправке напоминания {reminder_id}")
+            return SEND_RETRY, e
+        
+        except NetworkError as e:
+            logger.warning(f"⚠️ Сетевая ошибка при отправке напоминания {reminder_id}: {e}")
+            return SEND_RETRY, e
+        
+        except Exception as e:
+            # Окончательными считаются только Forbidden и BadRequest, остальное решает счётчик попыток
+            logger.error(f"❌ Ошибка при отправке напоминания {reminder_id} в чат {chat_id}: {e}")
+            logger.error(f"Детали ошибки: тип={type(e).__name__}, сообщение={str(e)}")
+            return SEND_RETRY, e
+
+class MaintenanceJob:
+    def __init__(self, bot_instance, interval: float = 600, batch_size: int = 200,
+                 offpeak_hours: tuple = (3, 5), archive_retention_days: int = 180,
+                 outbox_retention_days: int = 7, vacuum_pages: int = 500):
+        self.bot_instance = bot_instance
+        self.interval = interval
+        self.batch_size = batch_size
+        self.offpeak_hours = offpeak_hours
+        self.archive_retention_days = archive_retention_days
+        self.outbox_retention_days = outbox_retention_days
+        self.vacuum_pages = vacuum_pages
+        self.running = False
+        self.stop_event = Event()
+        self.thread = None
+        self.last_offpeak_date = None
+    
+    def start_job(self):
+        self.running = True
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run_job, daemon=True)
+        self.thread.start()
+        logger.info("Фоновое обслуживание базы запущено")
+    
+    def stop(self, timeout: float) -> bool:
+        # Пачки маленькие и коммитятся по одной, поэтому прерывание безопасно
+        self.running = False
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return False
+        logger.info("Фоновое обслуживание базы остановлено")
+        return True
+    
+    def _run_job(self):
+        while self.running:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при обслуживании базы: {e}")
+            self.stop_event.wait(self.interval)
+    
+    def run_once(self):
+        archived = self._archive_reminders()
+        pruned = self._prune_expired()
+        
+        if archived or pruned:
+            logger.info(f"Обслуживание базы: в архив {archived}, удалено устаревших записей {pruned}")
+        
+        local_now = self.bot_instance.clock.now(pytz.timezone('Europe/Moscow'))
+        start_hour, end_hour = self.offpeak_hours
+        if start_hour <= local_now.hour < end_hour and self.last_offpeak_date != local_now.date():
+            self._vacuum_and_analyze()
+            self.last_offpeak_date = local_now.date()
+    
+    def _archive_reminders(self) -> int:
+        total = 0
+        
+        while not self.stop_event.is_set():
+            conn = self.bot_instance.connect()
+            cursor = conn.cursor()
             
-            if not self.application.bot:
-                logger.error(f"❌ Бот не инициализирован для отправки напоминания {reminder_id}")
-                return
+            with profiler.span('maintenance.archive_batch'):
+                cursor.execute('''
+                    SELECT id FROM reminders 
+                    WHERE is_active = 0
+                    LIMIT ?
+                ''', (self.batch_size,))
+                ids = [row[0] for row in cursor.fetchall()]
+                
+                if ids:
+                    placeholders = ','.join('?' * len(ids))
+                    cursor.execute(f'''
+                        INSERT OR REPLACE INTO reminders_archive
+                            (id, user_id, message, reminder_time, frequency, created_at, last_sent, chat_id, archive_reason)
+                        SELECT id, user_id, message, reminder_time, frequency, created_at, last_sent, chat_id,
+                               CASE WHEN frequency = 'once' AND last_sent IS NOT NULL THEN 'completed' ELSE 'inactive' END
+                        FROM reminders 
+                        WHERE id IN ({placeholders})
+                    ''', ids)
+                    cursor.execute(f'DELETE FROM reminders WHERE id IN ({placeholders})', ids)
+                    cursor.execute(f'DELETE FROM reminder_recipients WHERE reminder_id IN ({placeholders})', ids)
+                    conn.commit()
             
-            await self.application.bot.send_message(chat_id=user_id, text=reminder_text)
-            logger.info(f"✅ Напоминание {reminder_id} отправлено пользователю {user_id}: {message}")
+            conn.close()
+            total += len(ids)
             
-        except Exception as e:
-            error_msg = str(e).lower()
-            if "bot was blocked by the user" in error_msg or "chat not found" in error_msg:
-                logger.warning(f"⚠️ Пользователь {user_id} заблокировал бота или чат не найден. Деактивируем напоминание {reminder_id}")
-                try:
-                    conn = sqlite3.connect(self.bot_instance.db_path)
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        UPDATE reminders 
-                        SET is_active = 0 
-                        WHERE id = ?
-                    ''', (reminder_id,))
+            if len(ids) < self.batch_size:
+                break
+            # Короткая пауза между пачками, чтобы не держать блокировку записи подряд
+            self.stop_event.wait(0.05)
+        
+        return total
+    
+    def _prune_expired(self) -> int:
+        conn = self.bot_instance.connect()
+        cursor = conn.cursor()
+        pruned = 0
+        
+        for sql, params in [
+            ('''
+                DELETE FROM outbox WHERE id IN (
+                    SELECT id FROM outbox 
+                    WHERE status != ? AND created_at < datetime('now', ?)
+                    LIMIT ?
+                )
+            ''', (OUTBOX_PENDING, f'-{self.outbox_retention_days} days', self.batch_size)),
+            ('''
+                DELETE FROM reminders_archive WHERE id IN (
+                    SELECT id FROM reminders_archive 
+                    WHERE archived_at < datetime('now', ?)
+                    LIMIT ?
+                )
+            ''', (f'-{self.archive_retention_days} days', self.batch_size)),
+        ]:
+            while not self.stop_event.is_set():
+                with profiler.span('maintenance.prune_batch'):
+                    cursor.execute(sql, params)
+                    deleted = cursor.rowcount
                     conn.commit()
-                    conn.close()
-                except Exception as db_error:
-                    logger.error(f"Ошибка при деактивации напоминания {reminder_id}: {db_error}")
+                pruned += deleted
+                if deleted < self.batch_size:
+                    break
+        
+        conn.close()
+        return pruned
+    
+    def _vacuum_and_analyze(self):
+        conn = self.bot_instance.connect()
+        cursor = conn.cursor()
+        
+        with profiler.span('maintenance.vacuum'):
+            # Режим INCREMENTAL включается в init_database; полный VACUUM здесь не делаем никогда
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] == 2:
+                cursor.execute(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})')
+                cursor.fetchall()
             else:
-                logger.error(f"❌ Ошибка при отправке напоминания {reminder_id} пользователю {user_id}: {e}")
-                logger.error(f"Детали ошибки: тип={type(e).__name__}, сообщение={str(e)}")
+                logger.warning("⚠️ База не в режиме incremental auto_vacuum, освобождение страниц пропущено")
+        
+        with profiler.span('maintenance.analyze'):
+            cursor.execute('ANALYZE')
+        
+        conn.commit()
+        conn.close()
+        
+        for entry in self.bot_instance.get_storage_report():
+            logger.info(f"Размер {entry['type']} {entry['name']}: строк {entry['rows']}, байт {entry['bytes']}")
+
+def shutdown_workers(bot_instance, scheduler, delivery_worker, timeout: float, maintenance=None):
+    logger.info(f"Остановка: завершаем текущую работу (не более {timeout:.0f} с)")
+    deadline = time.monotonic() + timeout
+    
+    if maintenance:
+        maintenance.stop(max(0, deadline - time.monotonic()))
+    
+    scheduler_stopped = scheduler.stop(max(0, deadline - time.monotonic()))
+    worker_stopped = delivery_worker.stop(max(0, deadline - time.monotonic()))
+    
+    state = scheduler.checkpoint()
+    state['shutdown_at'] = bot_instance.clock.time()
+    state['clean_shutdown'] = int(scheduler_stopped and worker_stopped)
+    state['pending_outbox'] = delivery_worker.pending_count()
+    bot_instance.save_checkpoint(state)
+    
+    logger.info(f"Контрольная точка сохранена, в очереди осталось уведомлений: {state['pending_outbox']}")
 
 def main():
+    global bot
+    
     BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
     
     if BOT_TOKEN == 'YOUR_BOT_TOKEN_HERE':
         print("❌ ОШИБКА: Установите переменную окружения BOT_TOKEN!")
         return
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    bot = ReminderBot(BOT_TOKEN)
+    bot.init_database()
+    
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
+    
+    async def on_start(application):
+        # Отправки идут через цикл polling: к нему привязан общий HTTP-клиент бота
+        delivery_worker.attach_loop(asyncio.get_running_loop())
+    
+    async def on_stop(application):
+        # Остановка потоков блокирует на join - уводим её из цикла событий
+        await asyncio.to_thread(shutdown_workers, bot, scheduler, delivery_worker,
+                                float(os.getenv('SHUTDOWN_TIMEOUT', '20')), maintenance)
     
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("list", list_reminders))
-    application.add_handler(CommandHandler("delete", delete_reminder))
-    application.add_handler(CommandHandler("timezone", timezone_command))
-    application.add_handler(CommandHandler("test", test_command))
-    application.add_handler(CommandHandler("debug", debug_command))
-    application.add_handler(CommandHandler("admin", admin_command))
+    # post_stop вызывается после остановки polling, но до закрытия HTTP-клиента бота,
+    # поэтому обработчик отправки ещё может дослать текущие сообщения
+    application = Application.builder().token(BOT_TOKEN).post_init(on_start).post_stop(on_stop).build()
     
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CommandHandler("start", profiled(start)))
+    application.add_handler(CommandHandler("help", profiled(help_command)))
+    application.add_handler(CommandHandler("list", profiled(list_reminders)))
+    application.add_handler(CommandHandler("delete", profiled(delete_reminder)))
+    application.add_handler(CommandHandler("subscribe", profiled(subscribe_command)))
+    application.add_handler(CommandHandler("unsubscribe", profiled(unsubscribe_command)))
+    application.add_handler(CommandHandler("timezone", profiled(timezone_command)))
+    application.add_handler(CommandHandler("test", profiled(test_command)))
+    application.add_handler(CommandHandler("debug", profiled(debug_command)))
+    application.add_handler(CommandHandler("admin", profiled(admin_command)))
     
-    scheduler = SchedulerManager(bot, application)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, profiled(handle_message)))
+    
+    scheduler = SchedulerManager(bot, application, tick_interval=float(os.getenv('SCHEDULER_TICK_INTERVAL', '30')))
     scheduler.start_scheduler()
     
+    delivery_worker = DeliveryWorker(bot, application)
+    delivery_worker.start_worker()
+    
+    offpeak_start, offpeak_end = (int(hour) for hour in os.getenv('MAINTENANCE_HOURS', '3-5').split('-'))
+    maintenance = MaintenanceJob(
+        bot,
+        offpeak_hours=(offpeak_start, offpeak_end),
+        archive_retention_days=int(os.getenv('ARCHIVE_RETENTION_DAYS', '180')),
+        outbox_retention_days=int(os.getenv('OUTBOX_RETENTION_DAYS', '7'))
+    )
+    maintenance.start_job()
+    
     print("🤖 Бот запущен! Нажмите Ctrl+C для остановки.")
     application.run_polling()
 
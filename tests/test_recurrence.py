@@ -0,0 +1,106 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram_reminder_bot as reminder_bot
+
+# Понедельник, 19 октября 2026, 08:00 по Москве - "сейчас" для всех фраз
+NOW = datetime(2026, 10, 19, 8, 0)
+
+@pytest.fixture
+def bot():
+    clock = reminder_bot.SimulatedClock(pytz.timezone('Europe/Moscow').localize(NOW))
+    return reminder_bot.ReminderBot('test', clock=clock)
+
+def dt(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d %H:%M')
+
+# фраза -> (frequency, после какого момента, ожидаемые срабатывания, посчитанные вручную)
+PHRASES = [
+    ("каждый день в 09:00", 'daily', '2026-10-19 08:00',
+     ['2026-10-19 09:00', '2026-10-20 09:00', '2026-10-21 09:00']),
+    ("по будням в 18:00", 'weekdays', '2026-10-23 19:00',
+     ['2026-10-26 18:00', '2026-10-27 18:00', '2026-10-28 18:00']),
+    ("по выходным в 10:00", 'weekends', '2026-10-19 08:00',
+     ['2026-10-24 10:00', '2026-10-25 10:00', '2026-10-31 10:00']),
+    ("каждый пт в 16:30", 'friday', '2026-10-19 08:00',
+     ['2026-10-23 16:30', '2026-10-30 16:30', '2026-11-06 16:30']),
+    ("3 раза в день", '3_times_daily', '2026-10-19 08:00',
+     ['2026-10-19 09:00', '2026-10-19 15:00', '2026-10-19 21:00', '2026-10-20 09:00']),
+    ("2 раза в неделю в 10:00", '2_times_weekly', '2026-10-19 08:00',
+     ['2026-10-19 10:00', '2026-10-23 10:00', '2026-10-26 10:00']),
+    ("по пн, ср, пт в 08:00", 'RRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR;BYTIME=08:00', '2026-10-19 08:00',
+     ['2026-10-19 08:00', '2026-10-21 08:00', '2026-10-23 08:00', '2026-10-26 08:00']),
+    ("каждые 3 дня в 10:00", 'RRULE:FREQ=DAILY;INTERVAL=3;BYTIME=10:00;DTSTART=2026-10-19', '2026-10-19 08:00',
+     ['2026-10-19 10:00', '2026-10-22 10:00', '2026-10-25 10:00']),
+    # Интервал в неделях отсчитывается от недели создания, а не от первого запроса
+    ("каждые 2 недели в 19:00", 'RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=MO;BYTIME=19:00;DTSTART=2026-10-19', '2026-10-20 00:00',
+     ['2026-11-02 19:00', '2026-11-16 19:00', '2026-11-30 19:00']),
+    # В месяцах без 31 числа срабатывания нет
+    ("каждое 31 число в 12:00", 'RRULE:FREQ=MONTHLY;BYMONTHDAY=31;BYTIME=12:00', '2026-10-19 08:00',
+     ['2026-10-31 12:00', '2026-12-31 12:00', '2027-01-31 12:00', '2027-03-31 12:00']),
+    ("каждый месяц 29 числа в 09:30", 'RRULE:FREQ=MONTHLY;BYMONTHDAY=29;BYTIME=09:30', '2027-01-30 00:00',
+     ['2027-03-29 09:30', '2027-04-29 09:30']),
+    # UNTIL включает сам день окончания и ничего после него
+    ("каждый день в 09:00 до 21.10.2026", 'RRULE:FREQ=DAILY;BYTIME=09:00;UNTIL=2026-10-21', '2026-10-19 08:00',
+     ['2026-10-19 09:00', '2026-10-20 09:00', '2026-10-21 09:00']),
+]
+
+@pytest.mark.parametrize('phrase, frequency, after, expected', PHRASES)
+def test_phrase_to_occurrences(bot, phrase, frequency, after, expected):
+    result = bot.parse_time_input(phrase)
+    assert result['frequency'] == frequency
+
+    rule = reminder_bot.RecurrenceRule.parse(result['frequency'], result['time'])
+    assert rule.next_occurrences(dt(after), 5)[:len(expected)] == [dt(value) for value in expected]
+
+def test_until_stops_after_end_date(bot):
+    result = bot.parse_time_input("каждый день в 09:00 до 21.10.2026")
+    rule = reminder_bot.RecurrenceRule.parse(result['frequency'], result['time'])
+
+    assert rule.next_occurrences(dt('2026-10-21 09:01'), 5) == []
+    assert rule.latest_today(dt('2026-10-21 10:00')) == dt('2026-10-21 09:00')
+    assert rule.next_after(dt('2026-10-21 10:00')) is None
+
+def test_rrule_round_trip():
+    frequency = 'RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;BYTIME=09:00,18:00;DTSTART=2026-10-19;UNTIL=2026-12-31'
+    assert reminder_bot.RecurrenceRule.parse(frequency, '09:00').to_rrule() == frequency
+
+@pytest.mark.parametrize('phrase', [
+    "каждые 2 дня в 25:00",
+    "каждые 0 дней в 10:00",
+    "каждое 5 число в 10:61",
+    "каждое 32 число в 10:00",
+    "по пн, ср в 24:00",
+    "0 раз в день",
+    "0 раз в неделю в 10:00",
+    "каждый день в 09:00 до 01.10.2026",
+    "каждый день в 09:00 до 31.02.2027",
+])
+def test_invalid_phrases_are_rejected(bot, phrase):
+    assert bot.parse_time_input(phrase) is None
+
+# 10 раз в день с 09:00 до 21:00 - шаг 80 минут, больше стандартного окна кэша
+TEN_TIMES = ['09:00', '10:20', '11:40', '13:00', '14:20', '15:40', '17:00', '18:20', '19:40', '21:00']
+
+def test_cached_window_keeps_all_slots_of_busy_rule():
+    rule = reminder_bot.RecurrenceRule.parse('10_times_daily', '09:00')
+
+    for day in ('2026-10-19', '2026-10-20'):
+        for slot, following in zip(TEN_TIMES, TEN_TIMES[1:] + [None]):
+            now = dt(f"{day} {slot}")
+            assert rule.latest_today(now) == now
+            if following:
+                assert rule.next_after(now) == dt(f"{day} {following}")
+        assert rule.next_after(dt(f"{day} 21:00")).strftime('%H:%M') == '09:00'
+
+def test_latest_today_ignores_yesterday():
+    rule = reminder_bot.RecurrenceRule.parse('daily', '09:00')
+
+    assert rule.latest_today(dt('2026-10-20 08:59')) is None
+    assert rule.latest_today(dt('2026-10-20 09:00')) == dt('2026-10-20 09:00')